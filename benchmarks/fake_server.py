@@ -0,0 +1,212 @@
+"""Local stand-in for the Sense API and realtime websocket, used by the benchmarks.
+
+Serves canned payloads for authenticate, renew, trends, devices, the monitor
+overview and the timeline, and streams realtime_update frames at a configurable
+rate and device count. Nothing leaves the machine.
+"""
+
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from time import time
+from typing import Optional
+
+import orjson
+from aiohttp import web
+
+MONITOR_ID = 123456
+USER_ID = 654321
+TIMELINE_ITEMS = 300
+
+
+def make_devices(count: int) -> list[dict]:
+    """Canned device list of the devices overview."""
+    return [
+        {"id": f"dev{i:05x}", "name": f"Device {i}", "icon": "socket", "tags": {"DeviceListAllowed": "true"}}
+        for i in range(count)
+    ]
+
+
+def make_trends(devices: list[dict]) -> dict:
+    """Canned trend data with an energy total per device."""
+    return {
+        "start": "2026-01-01T00:00:00.000Z",
+        "consumption": {
+            "total": 12.5,
+            "devices": [
+                {"id": d["id"], "name": d["name"], "icon": d["icon"], "total_kwh": 0.1 * (i % 10)}
+                for i, d in enumerate(devices)
+            ],
+        },
+        "production": {"total": 3.2},
+        "to_grid": 1.1,
+        "from_grid": 10.4,
+        "net_production": -9.3,
+        "production_pct": 25,
+        "solar_powered": 20,
+    }
+
+
+def make_timeline(count: int = TIMELINE_ITEMS) -> list[dict]:
+    """Canned timeline items, newest first, one minute apart."""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "time": (start - timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "type": "DeviceWasOn",
+            "device_id": f"dev{i % 16:05x}",
+        }
+        for i in range(count)
+    ]
+
+
+def make_frame(devices: list[dict], seq: int) -> bytes:
+    """A realtime_update message in which about a tenth of the devices change power."""
+    frame_devices = [
+        {"id": d["id"], "name": d["name"], "icon": d["icon"], "w": float(100 + (i + (seq if i % 10 == 0 else 0)) % 50)}
+        for i, d in enumerate(devices)
+    ]
+    payload = {
+        "epoch": int(time()),
+        "w": sum(d["w"] for d in frame_devices),
+        "solar_w": 250.0,
+        "hz": 60.0,
+        "voltage": [120.1, 119.9],
+        "devices": frame_devices,
+    }
+    return orjson.dumps({"payload": payload, "type": "realtime_update"})
+
+
+class FakeSenseServer:
+    """Fake Sense API and realtime server on localhost.
+
+    `frame_rate` is realtime frames per second per connection, 0 to send as
+    fast as possible. `latency` delays every API response by that many seconds.
+    Use `start`/`stop` from an event loop, or `start_in_thread`/`stop_thread`
+    for synchronous callers. `configure` points a Sense object at the server.
+    """
+
+    def __init__(
+        self, devices: int = 20, frame_rate: float = 2.0, latency: float = 0.0, host: str = "127.0.0.1"
+    ) -> None:
+        """Initialize the server."""
+        self.host = host
+        self.port: Optional[int] = None
+        self.frame_rate = frame_rate
+        self.latency = latency
+        self.devices = make_devices(devices)
+        self.requests = 0
+        self._trends = orjson.dumps(make_trends(self.devices))
+        self._devices_overview = orjson.dumps({"devices": self.devices})
+        self._timeline = make_timeline()
+        self._runner: Optional[web.AppRunner] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.host}:{self.port}/"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.host}:{self.port}/monitors/%s/realtimefeed?access_token=%s"
+
+    def configure(self, sense) -> None:
+        """Point a Sense object at this server and load canned credentials."""
+        sense.api_url = self.api_url
+        sense.ws_url = self.ws_url
+        sense.load_auth("fake-access-token", USER_ID, sense.device_id, "fake-refresh-token")
+        sense.set_monitor_id(MONITOR_ID)
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/authenticate", self._authenticate)
+        app.router.add_post("/renew", self._authenticate)
+        app.router.add_get("/app/history/trends", self._json(lambda: self._trends))
+        app.router.add_get("/app/monitors/{id}/devices/overview", self._json(lambda: self._devices_overview))
+        app.router.add_get(
+            "/app/monitors/{id}/overview",
+            self._json(lambda: orjson.dumps({"monitor_overview": {"monitor": {"id": MONITOR_ID}}})),
+        )
+        app.router.add_get("/users/{id}/timeline", self._timeline_page)
+        app.router.add_get("/monitors/{id}/realtimefeed", self._realtime)
+        return app
+
+    async def _respond(self, body: bytes) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=body, content_type="application/json")
+
+    def _json(self, body: callable):
+        async def handler(request: web.Request) -> web.Response:
+            return await self._respond(body())
+
+        return handler
+
+    async def _authenticate(self, request: web.Request) -> web.Response:
+        auth = {
+            "access_token": "fake-access-token",
+            "user_id": USER_ID,
+            "refresh_token": "fake-refresh-token",
+            "monitors": [{"id": MONITOR_ID}],
+        }
+        return await self._respond(orjson.dumps(auth))
+
+    async def _timeline_page(self, request: web.Request) -> web.Response:
+        n_items = int(request.query.get("n_items", 30))
+        prior = request.query.get("prior_to_item")
+        items = [i for i in self._timeline if not prior or i["time"] < prior][:n_items]
+        page = {"items": items, "more": len(items) == n_items and items[-1] is not self._timeline[-1]}
+        return await self._respond(orjson.dumps(page))
+
+    async def _realtime(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_bytes(orjson.dumps({"payload": {"online": True}, "type": "hello"}))
+        seq = 0
+        interval = 1 / self.frame_rate if self.frame_rate else 0
+        try:
+            while not ws.closed:
+                await ws.send_bytes(make_frame(self.devices, seq))
+                seq += 1
+                await asyncio.sleep(interval)
+        except ConnectionError:
+            pass
+        return ws
+
+    async def start(self) -> None:
+        """Start serving on a free port."""
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        """Stop serving."""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> None:
+        """Run the server on an event loop in a background thread."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-sense", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self) -> None:
+        """Stop a server started with `start_in_thread`."""
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,271 @@
+"""Run the benchmarks against the local fake Sense server and report the results.
+
+    python -m benchmarks.run [--quick] [--only NAME ...] [--output FILE] [--compare FILE]
+
+Each benchmark reports a few metrics; names ending in "_per_s" are better
+higher, all others better lower. `--output` writes the report as JSON together
+with the git commit and environment, and `--compare` prints the change against
+an earlier report.
+"""
+
+import argparse
+import asyncio
+import platform
+import statistics
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+
+import orjson
+from kasa_crypt import encrypt as tp_link_encrypt
+
+from sense_energy import ASyncSenseable, PlugInstance, Scale, Senseable
+from sense_energy.sense_api import decode_realtime_message
+from sense_energy.sense_link import SenseLinkServerProtocol
+
+from .fake_server import FakeSenseServer, make_devices, make_frame
+
+DISCOVERY_QUERY = tp_link_encrypt(
+    orjson.dumps({"system": {"get_sysinfo": {}}, "emeter": {"get_realtime": {}}}).decode()
+)[4:]
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def latency_stats(samples: list[float]) -> dict:
+    """p50 and p95 in milliseconds of durations in seconds."""
+    samples = sorted(samples)
+    return {
+        "p50_ms": 1000 * statistics.median(samples),
+        "p95_ms": 1000 * samples[int(0.95 * (len(samples) - 1))],
+    }
+
+
+def time_per_call(func, arg_list: list, repeat: int) -> float:
+    """Microseconds per call of func over the arguments, best of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for arg in arg_list:
+            func(arg)
+        best = min(best, perf_counter() - start)
+    return 1e6 * best / len(arg_list)
+
+
+@benchmark("decode")
+def bench_decode(scale: int) -> dict:
+    results = {}
+    for count in (20, 200):
+        frames = [make_frame(make_devices(count), seq) for seq in range(100)]
+        results[f"us_per_frame_{count}_devices"] = time_per_call(decode_realtime_message, frames, 5 * scale)
+    return results
+
+
+@benchmark("set_realtime")
+def bench_set_realtime(scale: int) -> dict:
+    results = {}
+    for count in (20, 200):
+        sense = Senseable()
+        frames = [orjson.loads(make_frame(make_devices(count), seq))["payload"] for seq in range(100)]
+        results[f"us_per_frame_{count}_devices"] = time_per_call(sense._set_realtime, frames, 5 * scale)
+    return results
+
+
+@benchmark("senselink_broadcast")
+def bench_senselink(scale: int) -> dict:
+    class Transport:
+        def __init__(self):
+            self.sent = 0
+
+        def sendto(self, data, addr):
+            self.sent += 1
+
+        def is_closing(self):
+            return False
+
+    results = {}
+    for count in (10, 100):
+        plugs = [PlugInstance(f"plug{i}", power=100.0 + i) for i in range(count)]
+        protocol = SenseLinkServerProtocol(lambda: plugs)
+        protocol.connection_made(Transport())
+        handle = lambda _: protocol.datagram_received(DISCOVERY_QUERY, ("127.0.0.1", 9999))
+        per_broadcast = time_per_call(handle, range(20), 3 * scale)
+        results[f"us_per_broadcast_{count}_plugs"] = per_broadcast
+        results[f"us_per_response_{count}_plugs"] = per_broadcast / count
+    # a storm of repeated requests from one source, suppressed by the dedupe window
+    storm = SenseLinkServerProtocol(lambda: plugs, dedupe_window=60)
+    storm.connection_made(Transport())
+    handle = lambda _: storm.datagram_received(DISCOVERY_QUERY, ("127.0.0.1", 9999))
+    results["us_per_suppressed_request"] = time_per_call(handle, range(1000), 3 * scale)
+    return results
+
+
+@benchmark("async_api")
+def bench_async_api(scale: int) -> dict:
+    async def run() -> dict:
+        server = FakeSenseServer()
+        await server.start()
+        sense = ASyncSenseable()
+        server.configure(sense)
+        try:
+            await sense.get_trend_data(Scale.DAY)  # warm up the connection
+            samples = []
+            for _ in range(50 * scale):
+                start = perf_counter()
+                await sense.get_trend_data(Scale.DAY)
+                samples.append(perf_counter() - start)
+            results = latency_stats(samples)
+            # identical requests would be coalesced, measure raw throughput instead
+            sense.coalesce_requests = False
+            count = 200 * scale
+            start = perf_counter()
+            await asyncio.gather(*(sense._fetch_trend_data(Scale.DAY) for _ in range(count)))
+            results["requests_per_s"] = count / (perf_counter() - start)
+            start = perf_counter()
+            items = [item async for item in sense.iter_timeline()]
+            results["timeline_items_per_s"] = len(items) / (perf_counter() - start)
+            return results
+        finally:
+            await sense._client_session.close()
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+@benchmark("sync_api")
+def bench_sync_api(scale: int) -> dict:
+    server = FakeSenseServer()
+    server.start_in_thread()
+    sense = Senseable()
+    server.configure(sense)
+    try:
+        sense.get_trend_data(Scale.DAY)
+        samples = []
+        for _ in range(50 * scale):
+            start = perf_counter()
+            sense.get_trend_data(Scale.DAY)
+            samples.append(perf_counter() - start)
+        results = latency_stats(samples)
+        count = 100 * scale
+        sense._size_connection_pool(8)
+        with ThreadPoolExecutor(8) as executor:
+            start = perf_counter()
+            list(executor.map(lambda _: sense._fetch_trend_data(Scale.DAY), range(count)))
+            results["requests_per_s"] = count / (perf_counter() - start)
+        start = perf_counter()
+        items = list(sense.iter_timeline())
+        results["timeline_items_per_s"] = len(items) / (perf_counter() - start)
+        return results
+    finally:
+        server.stop_thread()
+
+
+@benchmark("async_realtime")
+def bench_async_realtime(scale: int) -> dict:
+    async def run() -> dict:
+        server = FakeSenseServer(devices=50, frame_rate=0)
+        await server.start()
+        sense = ASyncSenseable()
+        server.configure(sense)
+        count = 500 * scale
+        try:
+            received = 0
+            start = perf_counter()
+            async for _ in sense._realtime_messages():
+                received += 1
+                if received == count:
+                    break
+            return {"frames_per_s": count / (perf_counter() - start)}
+        finally:
+            await sense._client_session.close()
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+@benchmark("sync_realtime")
+def bench_sync_realtime(scale: int) -> dict:
+    server = FakeSenseServer(devices=50, frame_rate=0)
+    server.start_in_thread()
+    sense = Senseable()
+    server.configure(sense)
+    count = 500 * scale
+    try:
+        received = 0
+        start = perf_counter()
+        stream = sense.get_realtime_stream()
+        for _ in stream:
+            received += 1
+            if received == count:
+                break
+        stream.close()
+        return {"frames_per_s": count / (perf_counter() - start)}
+    finally:
+        server.stop_thread()
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def print_report(results: dict, baseline: dict = None) -> None:
+    for name, metrics in results.items():
+        print(name)
+        for metric, value in metrics.items():
+            line = f"  {metric:<32} {value:>12.2f}"
+            old = (baseline or {}).get(name, {}).get(metric)
+            if old:
+                change = 100 * (value - old) / old
+                better = change > 0 if metric.endswith("_per_s") else change < 0
+                line += f"  {old:>12.2f}  {change:+7.1f}% {'better' if better else 'worse'}"
+            print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="benchmarks to run")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, noisier results")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="compare with an earlier JSON report")
+    args = parser.parse_args()
+
+    scale = 1 if args.quick else 4
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = BENCHMARKS[name](scale)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            baseline = orjson.loads(f.read())["results"]
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps({"environment": environment(), "results": results}, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
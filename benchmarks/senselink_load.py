@@ -0,0 +1,122 @@
+"""Load generator for SenseLink with many emulated plugs.
+
+    python -m benchmarks.senselink_load [--plugs 1000 10000] [--batch-size 256] [--rounds 5]
+                                        [--workers N] [--output FILE]
+
+Serves the plugs from a SenseLink on localhost and, from a separate process,
+sends discovery broadcasts to it, timing the first and the last response of
+each round. While the server answers, a ticker task on its event loop measures
+how long the loop was blocked. Each plug count is run with and without batching,
+and with `--workers` also in worker mode, broadcasting to 255.255.255.255 as
+worker mode answers broadcasts on all workers.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+from time import perf_counter
+
+import orjson
+
+from sense_energy import PlugInstance, SenseLink
+from sense_energy.sense_link import DEFAULT_BATCH_SIZE
+
+from .run import DISCOVERY_QUERY, print_report
+
+RECEIVE_BUFFER = 32 * 1024 * 1024
+IDLE_TIMEOUT = 2.0
+TICK = 0.001
+
+
+def client(port: int, plugs: int, rounds: int, results: multiprocessing.Queue, target: str) -> None:
+    """Send `rounds` broadcasts and report (first, last, received) per round."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.settimeout(IDLE_TIMEOUT)
+    for _ in range(rounds):
+        received = 0
+        first = last = None
+        start = perf_counter()
+        sock.sendto(DISCOVERY_QUERY, (target, port))
+        try:
+            while received < plugs:
+                sock.recv(4096)
+                last = perf_counter() - start
+                first = first or last
+                received += 1
+        except socket.timeout:
+            pass
+        results.put((first, last, received))
+    sock.close()
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("0.0.0.0", 0))
+        return sock.getsockname()[1]
+
+
+async def run_load(plug_count: int, batch_size, rounds: int, workers: int = 1) -> dict:
+    plugs = [PlugInstance(f"plug{i}", power=10.0 + i % 100) for i in range(plug_count)]
+    port = free_port()
+    link = SenseLink(lambda: plugs, port=port, batch_size=batch_size, devices_ttl=60, workers=workers)
+    await link.start()
+    target = "255.255.255.255" if workers > 1 else "127.0.0.1"
+
+    max_lag = 0.0
+
+    async def ticker() -> None:
+        nonlocal max_lag
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(TICK)
+            max_lag = max(max_lag, perf_counter() - start - TICK)
+
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=client, args=(port, plug_count, rounds, results, target))
+    process.start()
+    tick_task = asyncio.create_task(ticker())
+    loop = asyncio.get_running_loop()
+    try:
+        rows = [await loop.run_in_executor(None, results.get) for _ in range(rounds)]
+    finally:
+        tick_task.cancel()
+        await loop.run_in_executor(None, process.join)
+        await link.stop()
+
+    answered = [row for row in rows if row[0] is not None]
+    return {
+        "first_response_ms": 1000 * min(row[0] for row in answered) if answered else 0.0,
+        "last_response_ms": 1000 * max(row[1] for row in answered) if answered else 0.0,
+        "received_pct": 100 * sum(row[2] for row in rows) / (plug_count * rounds),
+        "max_loop_block_ms": 1000 * max_lag,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plugs", type=int, nargs="+", default=[1000, 10000], help="plug counts to test")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="batch size of the batched runs")
+    parser.add_argument("--rounds", type=int, default=5, help="broadcasts per run")
+    parser.add_argument("--workers", type=int, default=1, help="also run in worker mode with this many processes")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for count in args.plugs:
+        for batch_size in (None, args.batch_size):
+            name = f"{count}_plugs_" + (f"batch_{batch_size}" if batch_size else "unbatched")
+            results[name] = asyncio.run(run_load(count, batch_size, args.rounds))
+        if args.workers > 1:
+            name = f"{count}_plugs_{args.workers}_workers_batch_{args.batch_size}"
+            results[name] = asyncio.run(run_load(count, args.batch_size, args.rounds, args.workers))
+    print_report(results)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps({"results": results}, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 from .sense_api import SenseableBase, Scale, SenseDevice
 from .sense_exceptions import *
+from .sense_cache import ResponseCache
+from .sense_rate_limit import TokenBucket
+from .sense_history import RealtimeHistory
+from .sense_metrics import MetricsSink, PrometheusMetrics, OpenTelemetryMetrics
 
 from .senseable import Senseable
 from .asyncsenseable import ASyncSenseable
 from .plug_instance import PlugInstance
 from .sense_link import SenseLink
+from .sense_fleet import SenseFleet
+from .sense_backfill import TrendBackfill, TrendStore
 
 __version__ = "{{VERSION_PLACEHOLDER}}"
@@ -1,12 +1,15 @@
 import asyncio
+import logging
 import ssl
 import sys
+from collections import deque
 from functools import lru_cache
-from time import time
+from time import monotonic, perf_counter, time
+from typing import Optional
+from urllib.parse import urlencode
 from datetime import timezone
 
 import aiohttp
-import orjson
 import websockets
 
 from .sense_api import *
@@ -17,6 +20,13 @@ if sys.version_info[:2] < (3, 11):
 else:
     from asyncio import timeout as asyncio_timeout
 
+_LOGGER = logging.getLogger(__name__)
+
+FRAME_QUEUE_SIZE = 16
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_BLOCK = "block"
+
 
 @lru_cache(maxsize=None)
 def get_ssl_context(ssl_verify: bool, ssl_cafile: str) -> ssl.SSLContext:
@@ -43,9 +53,18 @@ class ASyncSenseable(SenseableBase):
         ssl_verify=True,
         ssl_cafile="",
         device_id=None,
+        state_file=None,
     ):
         """Init the ASyncSenseable object."""
         self._client_session = client_session or aiohttp.ClientSession()
+        self._realtime_task: Optional[asyncio.Task] = None
+        self._realtime_failures = 0
+        self._renew_task: Optional[asyncio.Task] = None
+        self._auth_renewal_task: Optional[asyncio.Task] = None
+        # share identical concurrent GETs, see _api_call
+        self.coalesce_requests = True
+        self.coalesce_stats = {"requests": 0, "coalesced": 0}
+        self._in_flight: dict[tuple, asyncio.Task] = {}
 
         super().__init__(
             username=username,
@@ -55,6 +74,7 @@ class ASyncSenseable(SenseableBase):
             ssl_verify=ssl_verify,
             ssl_cafile=ssl_cafile,
             device_id=device_id,
+            state_file=state_file,
         )
 
     def set_ssl_context(self, ssl_verify: bool, ssl_cafile: str):
@@ -69,7 +89,7 @@ class ASyncSenseable(SenseableBase):
 
         # Get auth token
         async with self._client_session.post(
-            API_URL + "authenticate",
+            self.api_url + "authenticate",
             headers=self.headers,
             timeout=self.api_timeout,
             data=auth_data,
@@ -104,7 +124,7 @@ class ASyncSenseable(SenseableBase):
 
         # Get auth token
         async with self._client_session.post(
-            API_URL + "authenticate/mfa",
+            self.api_url + "authenticate/mfa",
             headers=self.headers,
             timeout=self.api_timeout,
             data=mfa_data,
@@ -128,7 +148,7 @@ class ASyncSenseable(SenseableBase):
 
         # Get auth token
         async with self._client_session.post(
-            API_URL + "renew",
+            self.api_url + "renew",
             headers=self.headers,
             timeout=self.api_timeout,
             data=renew_data,
@@ -139,37 +159,97 @@ class ASyncSenseable(SenseableBase):
 
             self._set_auth_data(await resp.json())
 
+    async def _renew_auth_once(self, token: str) -> None:
+        """Renew the token that `token` was, sharing one renewal between concurrent
+        callers. Does nothing if the token was already renewed since."""
+        if self.sense_access_token != token:
+            return
+        if self._renew_task is None or self._renew_task.done():
+            self._renew_task = asyncio.create_task(self.renew_auth())
+        await asyncio.shield(self._renew_task)
+
+    async def _ensure_auth(self) -> None:
+        """Renew the token ahead of expiry. Failures are left to the 401 path."""
+        if not self._auth_expiring():
+            return
+        try:
+            await self._renew_auth_once(self.sense_access_token)
+        except (SenseAuthenticationException, aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            _LOGGER.debug("Failed to renew auth ahead of expiry: %s", ex)
+
+    async def start_auth_renewal(self) -> None:
+        """Start a background task renewing the token before it is `auth_renew_age` old."""
+        if self._auth_renewal_task and not self._auth_renewal_task.done():
+            return
+        self._auth_renewal_task = asyncio.create_task(self._auth_renewal_loop())
+
+    async def stop_auth_renewal(self) -> None:
+        """Stop the background token renewal."""
+        if not self._auth_renewal_task:
+            return
+        task, self._auth_renewal_task = self._auth_renewal_task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _auth_renewal_loop(self) -> None:
+        failures = 0
+        while self.auth_renew_age:
+            # renew a little early so callers never see an expiring token
+            await asyncio.sleep(max(0, self.auth_renew_age * 0.9 - self.auth_age))
+            try:
+                await self._renew_auth_once(self.sense_access_token)
+                failures = 0
+            except (SenseAuthenticationException, aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                _LOGGER.debug("Background auth renewal failed: %s", ex)
+                await asyncio.sleep(backoff_delay(failures))
+                failures += 1
+
     async def logout(self) -> None:
         """Log out of Sense."""
         # Get auth token
-        async with self._client_session.get(API_URL + "logout", timeout=self.api_timeout) as resp:
+        async with self._client_session.get(self.api_url + "logout", timeout=self.api_timeout) as resp:
             # check for 200 return
             if resp.status != 200:
                 raise SenseAPIException(f"API Return Code: {resp.status}")
 
     async def update_realtime(self, retry: bool = True) -> None:
-        """Update the realtime data (device status and current power)."""
+        """Update the realtime data (device status and current power).
+        Returns the latest cached frame without network I/O while a realtime
+        connection started with `start_realtime` is running."""
+        if self.realtime_running:
+            return self._realtime
         # rate limit API calls
         now = time()
         if self._realtime and self.rate_limit and self.last_realtime_call + self.rate_limit > now:
             return self._realtime
         self.last_realtime_call = now
+        await self._ensure_auth()
+        token = self.sense_access_token
         try:
             await self.async_realtime_stream(single=True)
         except SenseAuthenticationException as e:
             if retry:
-                await self.renew_auth()
+                await self._renew_auth_once(token)
                 await self.update_realtime(False)
             else:
                 raise e
 
-    async def async_realtime_stream(self, callback: callable = None, single: bool = False) -> None:
-        """Reads realtime data from websocket.  Data is passed to callback if available.
-        Continues reading realtime stream data forever unless 'single' is set to True.
+    async def _realtime_messages(self, raw: bool = False):
+        """Yield realtime updates from the websocket, forever.
+        With 'raw' set, lazily decoded RealtimeFrames are yielded and the realtime data is not set.
         """
-        url = WS_URL % (self.sense_monitor_id, self.sense_access_token)
+        url = self.ws_url % (self.sense_monitor_id, self.sense_access_token)
+        if self.rate_limiter:
+            await self.rate_limiter.async_acquire()
         # hello, features, [updates,] data
-        async with websockets.connect(url, ssl=self.ssl_context) as ws:
+        connect_start = perf_counter()
+        ssl_context = self.ssl_context if url.startswith("wss:") else None
+        async with websockets.connect(url, ssl=ssl_context) as ws:
+            if self.metrics is not None:
+                self.metrics.ws_connect(perf_counter() - connect_start)
             while True:
                 try:
                     async with asyncio_timeout(self.wss_timeout):
@@ -177,78 +257,298 @@ class ASyncSenseable(SenseableBase):
                 except asyncio.TimeoutError as ex:
                     raise SenseAPITimeoutException("API websocket timed out") from ex
 
-                result = orjson.loads(message)
-                if result.get("type") == "realtime_update":
-                    data = result["payload"]
-                    self._set_realtime(data)
-                    if callback:
-                        callback(data)
-                    if single:
-                        return
-                elif result.get("type") == "error":
-                    data = result["payload"]
-                    if not data["authorized"]:
-                        raise SenseAuthenticationException("Web Socket Unauthorized")
-                    raise SenseWebsocketException(data["error_reason"])
+                data = self._process_realtime_message(message, raw)
+                if data is not None:
+                    yield data
+
+    async def async_realtime_stream(self, callback: callable = None, single: bool = False, raw: bool = False) -> None:
+        """Reads realtime data from websocket.  Data is passed to callback if available.
+        Continues reading realtime stream data forever unless 'single' is set to True.
+        With 'raw' set, the callback gets a lazily decoded RealtimeFrame and the realtime
+        data is not set; pass the frame to `apply_frame` to set it.
+        """
+        messages = self._realtime_messages(raw)
+        try:
+            async for data in messages:
+                if callback:
+                    callback(data)
+                if single:
+                    return
+        finally:
+            await messages.aclose()
+
+    def realtime_frames(
+        self,
+        maxsize: int = FRAME_QUEUE_SIZE,
+        overflow: str = OVERFLOW_COALESCE,
+        rate: Optional[float] = None,
+        raw: bool = False,
+    ) -> "RealtimeFrameStream":
+        """Return an async iterator of realtime frames read by a background task into
+        a bounded queue, so a slow consumer does not stall the websocket.
+        `overflow` selects what happens when the queue is full, see RealtimeFrameStream,
+        and `rate` limits frames to about that many per second.
+
+            async with sense.realtime_frames(rate=1) as frames:
+                async for frame in frames:
+                    ...
+        """
+        return RealtimeFrameStream(self, maxsize, overflow, rate, raw)
+
+    @property
+    def realtime_running(self) -> bool:
+        """True while the persistent realtime connection is running."""
+        return self._realtime_task is not None and not self._realtime_task.done()
+
+    async def start_realtime(self) -> None:
+        """Start a background task that keeps the realtime websocket open,
+        reconnecting with backoff and renewing auth when needed."""
+        if self.realtime_running:
+            return
+        self._realtime_failures = 0
+        self._realtime_task = asyncio.create_task(self._realtime_loop())
+
+    async def stop_realtime(self) -> None:
+        """Stop the persistent realtime connection."""
+        if not self._realtime_task:
+            return
+        task, self._realtime_task = self._realtime_task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _realtime_received(self, data: dict) -> None:
+        """Reset the reconnect backoff once frames are flowing."""
+        self._realtime_failures = 0
+        self.last_realtime_call = time()
+
+    async def _realtime_loop(self) -> None:
+        """Read the realtime stream forever, reconnecting on failure."""
+        while True:
+            token = self.sense_access_token
+            try:
+                await self._ensure_auth()
+                token = self.sense_access_token
+                await self.async_realtime_stream(self._realtime_received)
+            except SenseAuthenticationException:
+                try:
+                    await self._renew_auth_once(token)
+                except Exception as ex:
+                    _LOGGER.debug("Failed to renew realtime auth: %s", ex)
+            except (
+                SenseAPITimeoutException,
+                SenseWebsocketException,
+                websockets.WebSocketException,
+                asyncio.TimeoutError,
+                OSError,
+            ) as ex:
+                _LOGGER.debug("Realtime connection lost: %s", ex)
+            except Exception:
+                # e.g. a malformed message; keep the loop alive and reconnect
+                _LOGGER.exception("Unexpected error in the realtime stream")
+            delay = backoff_delay(self._realtime_failures)
+            self._realtime_failures += 1
+            await asyncio.sleep(delay)
 
     async def get_realtime_future(self, callback: callable) -> None:
         """Returns an async Future to parse realtime data with callback"""
         await self.async_realtime_stream(callback)
 
     async def _api_call(self, url, payload={}, retry=False):
-        """Make a call to the Sense API directly and return the json results."""
+        """Make a call to the Sense API directly and return the json results.
+        Identical concurrent calls share one in-flight request and its result."""
+        if not self.coalesce_requests:
+            return await self._api_request(url, payload, retry)
+        key = (url, tuple(sorted(payload.items())) if payload else ())
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesce_stats["coalesced"] += 1
+        else:
+            self.coalesce_stats["requests"] += 1
+            task = self._in_flight[key] = asyncio.create_task(self._api_request(url, payload, retry))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # a cancelled caller must not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _api_request(self, url, payload={}, retry=False):
+        """Make a request to the Sense API, with retries and hedging if enabled,
+        and return the json results."""
+        if not retry:
+            await self._ensure_auth()
+        token = self.sense_access_token
+        headers = self.headers
+        entry = self.cache.get(url, payload) if self.cache is not None else None
+        if entry is not None:
+            if entry.fresh:
+                return entry.data
+            if entry.etag:
+                headers = {**self.headers, "If-None-Match": entry.etag}
+
+        status, resp_headers, data = await self._api_get_retried(url, headers, payload)
+        if not retry and status == 401:
+            await self._renew_auth_once(token)
+            return await self._api_request(url, payload, True)
+
+        # 4xx represents unauthenticated
+        if status == 401 or status == 403 or status == 404:
+            raise SenseAuthenticationException(f"API Return Code: {status}")
+
+        if status == 304 and entry is not None:
+            return self.cache.refresh(url, payload, entry)
+
+        if status == 429:
+            retry_after = parse_retry_after(resp_headers.get("Retry-After"))
+            if self.rate_limiter:
+                self.rate_limiter.backoff(retry_after)
+            raise SenseRateLimitException(retry_after)
+
+        if status != 200:
+            raise SenseAPIException(f"API Return Code: {status}")
+
+        if self.cache is not None:
+            self.cache.set(url, payload, data, resp_headers.get("ETag"))
+        return data
+
+    async def _api_get(self, url, headers, payload, attempt=0):
+        """Make one GET request. Returns the status, headers and, for 200, json results."""
         timeout = aiohttp.ClientTimeout(total=self.api_timeout)
+        if self.rate_limiter:
+            await self.rate_limiter.async_acquire()
+        start = perf_counter()
+        status = None
+        cancelled = False
         try:
-            async with self._client_session.get(
-                API_URL + url, headers=self.headers, timeout=timeout, data=payload
-            ) as resp:
-                if not retry and resp.status == 401:
-                    await self.renew_auth()
-                    return await self._api_call(url, payload, True)
-
-                # 4xx represents unauthenticated
-                if resp.status == 401 or resp.status == 403 or resp.status == 404:
-                    raise SenseAuthenticationException(f"API Return Code: {resp.status}")
-
-                if resp.status != 200:
-                    raise SenseAPIException(f"API Return Code: {resp.status}")
-
-                return await resp.json()
+            async with self._client_session.get(self.api_url + url, headers=headers, timeout=timeout, data=payload) as resp:
+                data = await resp.json() if resp.status == 200 else None
+                status = resp.status
         except asyncio.TimeoutError as ex:
             # timed out
             raise SenseAPITimeoutException("API call timed out") from ex
-
-    async def get_trend_data(self, scale: Scale, dt: datetime = None) -> None:
-        """Update trend data for specified scale from API.
-        Optionally set a date to fetch data from."""
+        except asyncio.CancelledError:
+            # e.g. the slower request of a hedge, which is not a failed call
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self._record_api_call(url, status, start, attempt)
+        if status == 200:
+            self._api_latencies.append(perf_counter() - start)
+        return status, resp.headers, data
+
+    async def _api_get_hedged(self, url, headers, payload, attempt=0):
+        """Make a GET, sending a second one if the first is slower than usual,
+        and return whichever succeeds first."""
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._api_get(url, headers, payload, attempt)
+        first = asyncio.create_task(self._api_get(url, headers, payload, attempt))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            self.hedge_stats["hedged"] += 1
+            second = asyncio.create_task(self._api_get(url, headers, payload, attempt))
+            pending.add(second)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_stats["hedge_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _api_get_retried(self, url, headers, payload):
+        """Make a GET, retrying timeouts, connection errors and 5xx responses
+        `api_retries` times with backoff."""
+        attempt = 0
+        while True:
+            try:
+                result = await self._api_get_hedged(url, headers, payload, attempt)
+                if result[0] < 500 or attempt >= self.api_retries:
+                    return result
+            except (SenseAPITimeoutException, aiohttp.ClientConnectionError):
+                if attempt >= self.api_retries:
+                    raise
+            await asyncio.sleep(backoff_delay(attempt, API_RETRY_DELAY, API_RETRY_DELAY_MAX))
+            attempt += 1
+
+    async def _fetch_trend_data(self, scale: Scale, dt: datetime = None) -> dict:
+        """Fetch trend data for specified scale from API without storing it."""
         if not dt:
             dt = datetime.now(timezone.utc)
-        json = self._api_call(
+        return await self._api_call(
             f"app/history/trends?monitor_id={self.sense_monitor_id}"
             + f"&device_id=always_on&scale={scale.name}&start={dt.strftime('%Y-%m-%dT%H:%M:%S')}"
         )
-        self._trend_data[scale] = await json
-        self._update_device_trends(scale)
 
-    async def update_trend_data(self, dt: datetime = None) -> None:
-        """Update trend data of all scales from API.
+    async def get_trend_data(self, scale: Scale, dt: datetime = None) -> None:
+        """Update trend data for specified scale from API.
         Optionally set a date to fetch data from."""
-        for scale in Scale:
-            await self.get_trend_data(scale, dt)
-
-    async def get_monitor_data(self):
-        """Get monitor overview info from API."""
+        self._set_trend_data(scale, await self._fetch_trend_data(scale, dt), dt)
+
+    async def update_trend_data(self, dt: datetime = None, max_concurrency: int = None, max_age: float = None) -> None:
+        """Update trend data of all scales from API concurrently.
+        Optionally set a date to fetch data from and a cap on concurrent requests.
+        With `max_age`, only scales not fetched within that many seconds are updated.
+        Scales that were fetched are applied even if others fail, in which case
+        SensePartialUpdateException is raised with the error of each failed scale,
+        chained from the first one. If every scale fails, that first error is raised
+        as is, e.g. SenseAuthenticationException."""
+        semaphore = asyncio.Semaphore(max_concurrency or len(Scale))
+
+        async def fetch(scale: Scale) -> dict:
+            async with semaphore:
+                return await self._fetch_trend_data(scale, dt)
+
+        scales = list(Scale) if dt else self.stale_scales(max_age)
+        results = await asyncio.gather(*(fetch(scale) for scale in scales), return_exceptions=True)
+        errors = {}
+        # apply in scale order so device merging is the same as a sequential update
+        for scale, result in zip(scales, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+                errors[scale] = result
+                continue
+            self._set_trend_data(scale, result, dt)
+        if errors:
+            first = next(iter(errors.values()))
+            if len(errors) == len(scales):
+                raise first
+            raise SensePartialUpdateException(errors) from first
+
+    async def get_monitor_data(self, max_age: float = None):
+        """Get monitor overview info from API.
+        With `max_age`, the loaded info is returned if fetched within that many seconds."""
+        if max_age is not None and self._monitor and not self.is_stale("monitor", max_age):
+            return self._monitor
         json = await self._api_call(f"app/monitors/{self.sense_monitor_id}/overview")
         if "monitor_overview" in json and "monitor" in json["monitor_overview"]:
             self._monitor = json["monitor_overview"]["monitor"]
+            self._mark_updated("monitor")
         return self._monitor
 
-    async def fetch_devices(self) -> None:
-        """Fetch discovered devices from API."""
+    async def fetch_devices(self, max_age: float = None) -> None:
+        """Fetch discovered devices from API.
+        With `max_age`, nothing is fetched if devices were fetched within that many seconds."""
+        if max_age is not None and not self.is_stale("devices", max_age):
+            return
         json = await self._api_call(f"app/monitors/{self.sense_monitor_id}/devices/overview")
         smart_plugs = {}
         for device in json["devices"]:
-            if not device["tags"].get("DeviceListAllowed", True) or device["tags"].get("MergeId", None):
+            merge_id = device["tags"].get("MergeId", None)
+            if merge_id:
+                self._device_aliases[device["id"]] = merge_id
+                continue
+            if not device["tags"].get("DeviceListAllowed", True):
                 continue
 
             # handle smart plugs after
@@ -258,11 +558,9 @@ class ASyncSenseable(SenseableBase):
                 smart_plugs[device["name"]].append(device)
                 continue
 
-            id = device["id"]
-            if id not in self._devices:
-                self._devices[id] = SenseDevice(id)
-            self._devices[id].name = device["name"]
-            self._devices[id].icon = device["icon"]
+            dev = self._add_device(device["id"])
+            self._set_device_name(dev, device["name"])
+            dev.icon = device["icon"]
 
         for devices in smart_plugs.values():
             device = {"tags": {"DateCreated": "2010-01-01T01:01:01.000Z"}}
@@ -270,11 +568,14 @@ class ASyncSenseable(SenseableBase):
                 if d["tags"].get("DateCreated", "") > device["tags"]["DateCreated"]:
                     device = d
 
-            id = device["id"]
-            if id not in self._devices:
-                self._devices[id] = SenseDevice(id)
-            self._devices[id].name = device["name"]
-            self._devices[id].icon = device["icon"]
+            dev = self._add_device(device["id"])
+            self._set_device_name(dev, device["name"])
+            dev.icon = device["icon"]
+            # older plugs with the same name are the same device
+            for d in devices:
+                if d is not device:
+                    self._device_aliases[d["id"]] = device["id"]
+        self._mark_updated("devices")
 
     async def get_discovered_device_names(self) -> list[str]:
         """Outdated. Get list of device names from API.
@@ -287,3 +588,166 @@ class ASyncSenseable(SenseableBase):
         Use fetch_discovered_devices and sense.devices instead."""
         json = self._api_call(f"monitors/{self.sense_monitor_id}/devices/overview")
         return await json["devices"]
+
+    async def get_all_usage_data(self, payload: dict = {"n_items": TIMELINE_PAGE_SIZE}) -> dict:
+        """Gets usage data by device from API
+
+        Args:
+            payload (dict, optional): known params are:
+                n_items: the number of items to return
+                device_id: limit results to a specific device_id
+                prior_to_item:. date in format YYYY-MM-DDTHH:MM:SS.mmmZ
+                rollup: ?
+
+                Defaults to {'n_items': 30}.
+
+        Returns:
+            dict: usage data
+        """
+        return await self._api_call(f"users/{self.sense_user_id}/timeline?{urlencode(payload)}")
+
+    async def iter_timeline(
+        self,
+        n_items: int = TIMELINE_PAGE_SIZE,
+        device_id: str = None,
+        prior_to_item: str = None,
+        since: datetime = None,
+        max_items: int = None,
+    ):
+        """Yield timeline items one at a time, newest first, paging through the
+        timeline automatically. The next page is fetched in the background while
+        the current one is consumed.
+
+        Args:
+            n_items: the number of items per page
+            device_id: limit results to a specific device_id
+            prior_to_item: start before this date, format YYYY-MM-DDTHH:MM:SS.mmmZ
+            since: stop at items older than this timezone aware datetime
+            max_items: stop after this many items
+        """
+        payload = self._timeline_payload(n_items, device_id, prior_to_item)
+        task = asyncio.create_task(self.get_all_usage_data(payload))
+        try:
+            count = 0
+            while task:
+                page = await task
+                payload = self._timeline_next_payload(page, payload, since)
+                task = asyncio.create_task(self.get_all_usage_data(payload)) if payload else None
+                for item in page.get("items") or []:
+                    if since and ciso8601.parse_datetime(item["time"]) < since:
+                        return
+                    yield item
+                    count += 1
+                    if max_items and count >= max_items:
+                        return
+        finally:
+            if task:
+                task.cancel()
+
+
+class RealtimeFrameStream:
+    """Async iterator of realtime frames backed by a bounded queue.
+
+    A background task reads the websocket into the queue. When the queue is
+    full, OVERFLOW_DROP_OLDEST discards the oldest queued frame,
+    OVERFLOW_COALESCE replaces the newest queued frame with the new one, and
+    OVERFLOW_BLOCK pauses reading until the consumer catches up. Errors from
+    the websocket are raised to the consumer once the queue is drained.
+    """
+
+    def __init__(
+        self,
+        sense: ASyncSenseable,
+        maxsize: int = FRAME_QUEUE_SIZE,
+        overflow: str = OVERFLOW_COALESCE,
+        rate: Optional[float] = None,
+        raw: bool = False,
+    ) -> None:
+        """Initialize the stream. Reading starts on first iteration."""
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got {maxsize}")
+        self._sense = sense
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.rate = rate
+        self.raw = raw
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.decimated = 0
+        self._frames: deque = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+        self._last_accepted = 0.0
+
+    def __aiter__(self) -> "RealtimeFrameStream":
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+        return self
+
+    async def __anext__(self):
+        while not self._frames:
+            if self._reader.done():
+                if not self._reader.cancelled() and self._reader.exception():
+                    raise self._reader.exception()
+                raise StopAsyncIteration
+            self._ready.clear()
+            await self._ready.wait()
+        frame = self._frames.popleft()
+        self._space.set()
+        return frame
+
+    async def __aenter__(self) -> "RealtimeFrameStream":
+        return self.__aiter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Stop reading the websocket."""
+        if self._reader and not self._reader.done():
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def pending(self) -> int:
+        """Number of frames queued for the consumer."""
+        return len(self._frames)
+
+    async def _read(self) -> None:
+        try:
+            async for frame in self._sense._realtime_messages(self.raw):
+                self.received += 1
+                if self.rate:
+                    now = monotonic()
+                    if now - self._last_accepted < 1 / self.rate:
+                        self.decimated += 1
+                        continue
+                    self._last_accepted = now
+                await self._put(frame)
+        finally:
+            self._ready.set()
+
+    async def _put(self, frame) -> None:
+        frames = self._frames
+        if len(frames) >= self.maxsize:
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                frames.popleft()
+                self.dropped += 1
+            elif self.overflow == OVERFLOW_COALESCE:
+                frames[-1] = frame
+                self.coalesced += 1
+                self._ready.set()
+                return
+            else:
+                while len(frames) >= self.maxsize:
+                    self._space.clear()
+                    await self._space.wait()
+        frames.append(frame)
+        self._ready.set()
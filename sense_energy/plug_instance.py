@@ -5,6 +5,12 @@ from time import time
 from typing import Optional, Any
 from functools import lru_cache
 
+import orjson
+from kasa_crypt import encrypt as tp_link_encrypt
+
+# initial key of the TP-Link autokey cipher
+TP_LINK_KEY = 171
+
 
 @lru_cache(maxsize=256)
 def _generate_mac(device_id: str) -> str:
@@ -14,6 +20,20 @@ def _generate_mac(device_id: str) -> str:
     return ":".join("%02X" % b for b in mac)
 
 
+def _encrypt_tail(key: int, data: bytes) -> bytes:
+    """Continue TP-Link encryption of a message whose previous encrypted byte was `key`."""
+    seed = key ^ TP_LINK_KEY
+    if seed < 0x80:
+        # a leading plaintext byte of `seed` moves the cipher to `key`, so the
+        # native encrypt can continue from there; drop that byte and the header
+        return tp_link_encrypt(chr(seed) + data.decode("utf-8"))[5:]
+    out = bytearray(data)
+    for i, b in enumerate(out):
+        key ^= b
+        out[i] = key
+    return bytes(out)
+
+
 @lru_cache(maxsize=256)
 def _generate_device_id(id: str) -> str:
     """Generate a device ID from the ID only once."""
@@ -25,13 +45,14 @@ class PlugInstance:
 
     __slots__ = (
         "id",
-        "voltage",
-        "power",
-        "current",
-        "alias",
+        "_voltage",
+        "_power",
+        "_current",
+        "_alias",
         "start_time",
         "device_id",
         "mac",
+        "_encrypted_prefix",
     )
 
     def __init__(
@@ -47,6 +68,7 @@ class PlugInstance:
     ) -> None:
         """Initialize a plug instance."""
         self.id = id
+        self._encrypted_prefix: Optional[bytes] = None
         self.voltage = voltage
         self.power = power
         self.current = current
@@ -65,9 +87,45 @@ class PlugInstance:
         else:
             self.mac = _generate_mac(self.device_id)
 
-    def generate_response(self) -> dict[str, dict[str, Any]]:
-        """Generate a response dict for the plug."""
-        # Response dict
+    @property
+    def voltage(self) -> float:
+        return self._voltage
+
+    @voltage.setter
+    def voltage(self, value: float) -> None:
+        self._voltage = value
+        self._encrypted_prefix = None
+
+    @property
+    def power(self) -> float:
+        return self._power
+
+    @power.setter
+    def power(self, value: float) -> None:
+        self._power = value
+        self._encrypted_prefix = None
+
+    @property
+    def current(self) -> float:
+        return self._current
+
+    @current.setter
+    def current(self, value: float) -> None:
+        self._current = value
+        self._encrypted_prefix = None
+
+    @property
+    def alias(self) -> str:
+        return self._alias
+
+    @alias.setter
+    def alias(self, value: str) -> None:
+        self._alias = value
+        self._encrypted_prefix = None
+
+    def _response_without_on_time(self) -> dict[str, dict[str, Any]]:
+        """Response dict without on_time. "system" and its "get_sysinfo" are last,
+        so on_time can be appended at the very end of the encoded response."""
         return {
             "emeter": {
                 "get_realtime": {
@@ -94,7 +152,6 @@ class PlugInstance:
                     "dev_name": "Wi-Fi Smart Plug With Energy Monitoring",
                     "icon_hash": "",
                     "relay_state": 1 if self.power > 0 else 0,
-                    "on_time": time() - self.start_time,
                     "active_mode": "none",
                     "feature": "TIM:ENE",
                     "updating": 0,
@@ -105,3 +162,23 @@ class PlugInstance:
                 }
             },
         }
+
+    def generate_response(self) -> dict[str, dict[str, Any]]:
+        """Generate a response dict for the plug."""
+        response = self._response_without_on_time()
+        response["system"]["get_sysinfo"]["on_time"] = time() - self.start_time
+        return response
+
+    def encrypted_response(self) -> bytes:
+        """The response encrypted for sending, without the length prefix.
+        Everything up to on_time is encrypted once and cached until power, current,
+        voltage or alias change; only on_time and the closing braces are encrypted
+        per call."""
+        prefix = self._encrypted_prefix
+        if prefix is None:
+            # drop the closing braces of get_sysinfo, system and the response
+            head = orjson.dumps(self._response_without_on_time())[:-3] + b',"on_time":'
+            # strip the 4 byte length header
+            prefix = self._encrypted_prefix = tp_link_encrypt(head.decode("utf-8"))[4:]
+        tail = orjson.dumps(time() - self.start_time) + b"}}}"
+        return prefix + _encrypt_tail(prefix[-1], tail)
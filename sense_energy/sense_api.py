@@ -1,15 +1,36 @@
+from collections import deque
 from enum import Enum, auto
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 import ciso8601
+import logging
+import orjson
+import os
+import random
 import uuid
+from time import perf_counter, time
+from .sense_cache import ResponseCache
+from .sense_rate_limit import TokenBucket, parse_retry_after
+from .sense_history import HISTORY_CAPACITY, HISTORY_DEVICES, RealtimeHistory
+from .sense_metrics import MetricsSink, endpoint_name
 from .sense_exceptions import *
 
+_LOGGER = logging.getLogger(__name__)
+
 API_URL = "https://api.sense.com/apiservice/api/v1/"
 WS_URL = "wss://clientrt.sense.com/monitors/%s/realtimefeed?access_token=%s"
 API_TIMEOUT = 5
 WSS_TIMEOUT = 5
 RATE_LIMIT = 60
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 300
+TIMELINE_PAGE_SIZE = 30
+STATE_VERSION = 1
+AUTH_RENEW_AGE = 60 * 60
+API_RETRY_DELAY = 0.5
+API_RETRY_DELAY_MAX = 8
+LATENCY_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
 
 
 class Scale(Enum):
@@ -20,16 +41,129 @@ class Scale(Enum):
     CYCLE = auto()
 
 
+def backoff_delay(attempt: int, base: float = RECONNECT_DELAY_MIN, cap: float = RECONNECT_DELAY_MAX) -> float:
+    """Exponential backoff delay for the given attempt number, with jitter."""
+    delay = min(cap, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RealtimeFrame:
+    """A raw realtime websocket message that is decoded lazily.
+
+    The message type is read from the end of the raw message without decoding
+    it when the server puts the type key last, which it does. The message is
+    decoded at most once, the first time a payload field is read, and no
+    SenseDevice state is built unless the frame is passed to `apply_frame`.
+    """
+
+    __slots__ = ("raw", "_message", "_type")
+
+    def __init__(self, raw: Union[bytes, str]) -> None:
+        self.raw = raw
+        self._message: Optional[dict] = None
+        self._type: Optional[str] = None
+
+    @property
+    def type(self) -> Optional[str]:
+        """Message type, e.g. "realtime_update", "hello" or "error"."""
+        if self._type is None:
+            self._type = _peek_type(self.raw)
+            if self._type is None:
+                self._type = self.message.get("type")
+        return self._type
+
+    @property
+    def message(self) -> dict:
+        """The fully decoded message."""
+        if self._message is None:
+            self._message = orjson.loads(self.raw)
+        return self._message
+
+    @property
+    def payload(self) -> dict:
+        return self.message.get("payload", {})
+
+    @property
+    def w(self) -> float:
+        return self.payload.get("w", 0)
+
+    @property
+    def solar_w(self) -> float:
+        return self.payload.get("solar_w", 0)
+
+    @property
+    def hz(self) -> float:
+        return self.payload.get("hz", 0)
+
+    @property
+    def voltage(self) -> list[float]:
+        return self.payload.get("voltage", [])
+
+    @property
+    def epoch(self) -> Optional[int]:
+        return self.payload.get("epoch")
+
+    @property
+    def devices(self) -> list[dict]:
+        return self.payload.get("devices", [])
+
+
+def _peek_type(raw: Union[bytes, str]) -> Optional[str]:
+    """Return the message type if it is the last key of the top level object."""
+    if isinstance(raw, str):
+        key, close, quote = '"type":"', '"}', '"'
+    else:
+        key, close, quote = b'"type":"', b'"}', b'"'
+    start = raw.rfind(key)
+    if start < 0:
+        return None
+    tail = raw[start + len(key) :].rstrip()
+    # a nested object would be followed by more closing braces or keys
+    if not tail.endswith(close) or quote in tail[:-2]:
+        return None
+    value = tail[:-2]
+    return value if isinstance(value, str) else value.decode()
+
+
+def decode_realtime_message(message: Union[bytes, str], raw: bool = False):
+    """Decode a realtime websocket message.
+    Returns the payload of a realtime update, or a lazily decoded RealtimeFrame
+    with 'raw' set, and None for other messages. Raises for error messages."""
+    msg_type = _peek_type(message)
+    if msg_type is not None and msg_type != "realtime_update" and msg_type != "error":
+        # hello, features and other messages are skipped without decoding
+        return None
+    if raw:
+        frame = RealtimeFrame(message)
+        if msg_type is None:
+            msg_type = frame.type
+        if msg_type == "realtime_update":
+            return frame
+        payload = frame.payload
+    else:
+        result = orjson.loads(message)
+        if msg_type is None:
+            msg_type = result.get("type")
+        payload = result.get("payload")
+        if msg_type == "realtime_update":
+            return payload
+    if msg_type == "error":
+        if not payload["authorized"]:
+            raise SenseAuthenticationException("Web Socket Unauthorized")
+        raise SenseWebsocketException(payload["error_reason"])
+    return None
+
+
 class SenseDevice:
+    __slots__ = ("id", "name", "icon", "is_on", "power_w", "energy_kwh")
+
     def __init__(self, id):
         self.id = id
         self.name = ""
         self.icon = ""
         self.is_on = False
         self.power_w = 0.0
-        self.energy_kwh = {}
-        for scale in Scale:
-            self.energy_kwh[scale] = 0.0
+        self.energy_kwh = dict.fromkeys(Scale, 0.0)
 
 
 class SenseableBase(object):
@@ -42,22 +176,52 @@ class SenseableBase(object):
         ssl_verify: bool = True,
         ssl_cafile: str = "",
         device_id: str = None,
+        state_file: str = None,
     ):
-        """Initialize SenseableBase object."""
+        """Initialize SenseableBase object.
+        If `state_file` exists, trend, device and monitor state are loaded from it."""
 
         # Timeout instance variables
         self.api_timeout = api_timeout
         self.wss_timeout = wss_timeout
         self.rate_limit = RATE_LIMIT
+        # API and realtime websocket endpoints, overridable e.g. to run against a local server
+        self.api_url = API_URL
+        self.ws_url = WS_URL
         self.last_realtime_call = 0
+        # renew the access token once it is this many seconds old, None to only renew on 401
+        self.auth_renew_age: Optional[float] = AUTH_RENEW_AGE
+        self._auth_time = 0.0
+        # retry GETs that time out or fail with 5xx this many times, with backoff
+        self.api_retries = 0
+        # send a second GET when the first is slower than the recent p95 latency
+        self.api_hedge = False
+        self.hedge_stats = {"hedged": 0, "hedge_won": 0}
+        self._api_latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
 
         self._mfa_token = ""
         self._realtime = {}
+        # device id -> raw power of the previous realtime frame
+        self._realtime_power: dict[str, float] = {}
         self._devices: dict[str, SenseDevice] = {}
+        # device name -> id, and merged or renamed device id -> current id
+        self._device_names: dict[str, str] = {}
+        self._device_aliases: dict[str, str] = {}
         self._trend_data: dict[Scale, dict] = {}
         self._monitor = {}
+        # Optional response cache for rarely changing endpoints, see ResponseCache
+        self.cache: Optional[ResponseCache] = None
+        # Optional limiter for API calls and websocket connects, may be shared between objects
+        self.rate_limiter: Optional[TokenBucket] = None
+        # Optional buffer of recent realtime frames, see enable_history
+        self.history: Optional[RealtimeHistory] = None
+        self.metrics: Optional[MetricsSink] = None
+        # time each part of the state was last fetched, see is_stale
+        self._updated: dict[str, float] = {}
         for scale in Scale:
             self._trend_data[scale] = {}
+        if state_file:
+            self.load_state(state_file)
         self.set_ssl_context(ssl_verify, ssl_cafile)
         if device_id:
             self.device_id = device_id
@@ -82,11 +246,34 @@ class SenseableBase(object):
     def set_monitor_id(self, monitor_id: str):
         self.sense_monitor_id = monitor_id
 
+    @property
+    def auth_age(self) -> float:
+        """Seconds since the access token was issued or loaded."""
+        return time() - self._auth_time if self._auth_time else 0.0
+
+    def _auth_expiring(self) -> bool:
+        """True if the access token should be renewed ahead of expiry."""
+        return bool(self._auth_time and self.auth_renew_age and self.auth_age >= self.auth_renew_age)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a GET: the p95 of recent latencies.
+        None if hedging is off or there are too few samples yet."""
+        if not self.api_hedge or len(self._api_latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self._api_latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def enable_history(self, capacity: int = HISTORY_CAPACITY, max_devices: int = HISTORY_DEVICES):
+        """Record the last `capacity` realtime frames in `sense.history`."""
+        self.history = RealtimeHistory(capacity, max_devices)
+        return self.history
+
     def _set_auth_data(self, data):
         """Set the authentication data for the session."""
         self.sense_access_token = data["access_token"]
         self.sense_user_id = data["user_id"]
         self.refresh_token = data["refresh_token"]
+        self._auth_time = time()
 
         # create the auth header
         self.headers = {
@@ -94,46 +281,234 @@ class SenseableBase(object):
             "Authorization": "bearer {}".format(self.sense_access_token),
         }
 
+    def _mark_updated(self, key: str) -> None:
+        self._updated[key] = time()
+
+    def is_stale(self, key: str, max_age: float) -> bool:
+        """True if part of the state ("monitor", "devices" or a Scale name) was
+        not fetched within `max_age` seconds."""
+        return self._updated.get(key, 0) + max_age <= time()
+
+    def stale_scales(self, max_age: Optional[float] = None) -> list[Scale]:
+        """Scales whose trend data was not fetched within `max_age` seconds, or all."""
+        if max_age is None:
+            return list(Scale)
+        return [scale for scale in Scale if self.is_stale(scale.name, max_age)]
+
+    def save_state(self, path: str) -> None:
+        """Snapshot trend, device and monitor state to a file for a warm start."""
+        state = {
+            "version": STATE_VERSION,
+            "monitor": self._monitor,
+            "trend_data": {scale.name: data for scale, data in self._trend_data.items()},
+            "devices": [
+                {
+                    "id": dev.id,
+                    "name": dev.name,
+                    "icon": dev.icon,
+                    "energy_kwh": {scale.name: kwh for scale, kwh in dev.energy_kwh.items()},
+                }
+                for dev in self._devices.values()
+            ],
+            "device_aliases": self._device_aliases,
+            "updated": self._updated,
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(state))
+        os.replace(tmp, path)
+
+    def load_state(self, path: str) -> bool:
+        """Load a snapshot written by save_state. Returns False if there is none
+        or it cannot be read, in which case nothing is loaded."""
+        try:
+            with open(path, "rb") as f:
+                state = orjson.loads(f.read())
+            if state.get("version") != STATE_VERSION:
+                return False
+            monitor = state["monitor"]
+            trend_data = {Scale[name]: data for name, data in state["trend_data"].items()}
+            devices = [
+                (d["id"], d["name"], d["icon"], {Scale[name]: kwh for name, kwh in d["energy_kwh"].items()})
+                for d in state["devices"]
+            ]
+            aliases = dict(state["device_aliases"])
+            updated = dict(state["updated"])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as ex:
+            _LOGGER.warning("Ignoring unreadable state file %s: %r", path, ex)
+            return False
+        self._monitor = monitor
+        self._trend_data.update(trend_data)
+        for id, name, icon, energy_kwh in devices:
+            dev = self._add_device(id)
+            self._set_device_name(dev, name)
+            dev.icon = icon
+            dev.energy_kwh.update(energy_kwh)
+        self._device_aliases.update(aliases)
+        self._updated.update(updated)
+        return True
+
+    def _set_trend_data(self, scale: Scale, data: dict, dt: Optional[datetime] = None) -> None:
+        """Store trend data fetched for a scale; current data (no `dt`) is marked fresh."""
+        self._trend_data[scale] = data
+        if self.metrics is None:
+            self._update_device_trends(scale)
+        else:
+            start = perf_counter()
+            self._update_device_trends(scale)
+            self.metrics.processing("device_trends", perf_counter() - start)
+        if dt is None:
+            self._mark_updated(scale.name)
+
+    def _add_device(self, id: str) -> SenseDevice:
+        """Return the device with the given id, creating it if needed."""
+        dev = self._devices.get(id)
+        if dev is None:
+            dev = self._devices[id] = SenseDevice(id)
+        return dev
+
+    def _set_device_name(self, dev: SenseDevice, name: str) -> None:
+        """Set a device name and index it.
+        A name points at the first device currently using it. An earlier name
+        keeps pointing at a renamed device only while no other device uses it."""
+        old, dev.name = dev.name, name
+        if old and old != name and self._device_names.get(old) == dev.id:
+            # hand the old name over to another device still using it, if any
+            owner = next((d.id for d in self._devices.values() if d.name == old), None)
+            if owner is not None:
+                self._device_names[old] = owner
+        if name:
+            owner = self._devices.get(self._device_names.get(name))
+            if owner is None or owner.name != name:
+                self._device_names[name] = dev.id
+
+    def _resolve_device_id(self, id: str, name: str) -> Optional[str]:
+        """Return the id of a known device matching an id or, for merged and
+        renamed devices, an alias or name. Returns None for unknown devices.
+        Name matches are not remembered as aliases, as names can move."""
+        if id in self._devices:
+            return id
+        alias = self._device_aliases.get(id)
+        if alias in self._devices:
+            return alias
+        match = self._device_names.get(name)
+        if match in self._devices:
+            return match
+        return None
+
     def _update_device_trends(self, scale: Scale):
         if not self._trend_data[scale]["consumption"].get("devices"):
             return
         for d in self._devices.values():
             d.energy_kwh[scale] = 0
         for d in self._trend_data[scale]["consumption"]["devices"]:
-            id = d["id"]
-            if id not in self._devices:
-                # try to match device name and combine with newer device
-                for did in self._devices:
-                    if self._devices[did].name == d["name"]:
-                        id = did
-                        break
-                else:
-                    self._devices[id] = SenseDevice(id)
-                    self._devices[id].icon = d["icon"]
-            if not self._devices[id].name:
-                self._devices[id].name = d["name"]
-            self._devices[id].energy_kwh[scale] += d["total_kwh"]
+            # try to match device name and combine with newer device
+            id = self._resolve_device_id(d["id"], d["name"])
+            if id is None:
+                id = d["id"]
+                self._add_device(id).icon = d["icon"]
+            dev = self._devices[id]
+            if not dev.name:
+                self._set_device_name(dev, d["name"])
+            dev.energy_kwh[scale] += d["total_kwh"]
 
     @property
     def devices(self) -> list[SenseDevice]:
         """List of discovered device names."""
         return self._devices.values()
 
-    def _set_realtime(self, data):
-        """Sets the realtime data structure."""
-        json_devices = data.get("devices", {})
+    def _set_realtime(self, data) -> dict[str, float]:
+        """Sets the realtime data structure.
+        Only devices whose power changed since the previous frame are updated.
+        Returns the changed devices as a dict of id to power in watts."""
+        json_devices = data.get("devices")
         if not json_devices:
-            return
+            return {}
         self._realtime = data
-        for dev in self._devices.values():
-            dev.is_on = False
-            dev.power_w = 0
+        if self.history is not None:
+            self.history.append(data)
+        devices = self._devices
+        previous = self._realtime_power
+        current = {}
+        changed = {}
         for d in json_devices:
             id = d["id"]
-            if id not in self._devices:
-                self._devices[id] = SenseDevice(id)
-            self._devices[id].power_w = float(d["w"])
-            self._devices[id].is_on = self._devices[id].power_w > 0
+            w = current[id] = d["w"]
+            if previous.pop(id, None) == w and id in devices:
+                continue
+            dev = devices.get(id)
+            if dev is None:
+                dev = self._add_device(id)
+                self._set_device_name(dev, d.get("name", ""))
+            dev.power_w = float(w)
+            dev.is_on = dev.power_w > 0
+            changed[id] = dev.power_w
+        # devices missing from this frame are off
+        for id in previous:
+            dev = devices.get(id)
+            if dev is not None and (dev.is_on or dev.power_w):
+                dev.power_w = 0.0
+                dev.is_on = False
+                changed[id] = 0.0
+        self._realtime_power = current
+        return changed
+
+    def apply_frame(self, frame: RealtimeFrame) -> dict[str, float]:
+        """Set the realtime data from a frame of a raw realtime stream."""
+        return self._set_realtime(frame.payload)
+
+    def _process_realtime_message(self, message: Union[bytes, str], raw: bool = False):
+        """Decode a websocket message and, unless raw, set the realtime data.
+        Returns the update, or None for messages without one."""
+        metrics = self.metrics
+        if metrics is None:
+            data = decode_realtime_message(message, raw)
+            if data is not None and not raw:
+                self._set_realtime(data)
+            return data
+        start = perf_counter()
+        data = decode_realtime_message(message, raw)
+        if data is None:
+            return None
+        decoded = perf_counter()
+        metrics.processing("decode", decoded - start)
+        staleness = None
+        if not raw:
+            self._set_realtime(data)
+            metrics.processing("set_realtime", perf_counter() - decoded)
+            epoch = data.get("epoch")
+            if epoch:
+                staleness = time() - epoch
+        metrics.frame(staleness)
+        return data
+
+    def _record_api_call(self, url: str, status: Optional[int], start: float, attempt: int) -> None:
+        """Report a finished GET to the metrics sink, if any."""
+        if self.metrics is not None:
+            self.metrics.api_call(endpoint_name(url), status, perf_counter() - start, attempt)
+
+    @staticmethod
+    def _timeline_payload(n_items: int, device_id: Optional[str], prior_to_item: Optional[str]) -> dict:
+        """Build the payload for the first timeline page."""
+        payload = {"n_items": n_items}
+        if device_id:
+            payload["device_id"] = device_id
+        if prior_to_item:
+            payload["prior_to_item"] = prior_to_item
+        return payload
+
+    @staticmethod
+    def _timeline_next_payload(page: dict, payload: dict, since: Optional[datetime]) -> Optional[dict]:
+        """Return the payload for the page after `page`, or None if there is none
+        or its items would all be older than `since`."""
+        items = page.get("items") or []
+        if not items or not page.get("more", len(items) >= payload["n_items"]):
+            return None
+        if since and ciso8601.parse_datetime(items[-1]["time"]) < since:
+            return None
+        return {**payload, "prior_to_item": items[-1]["time"]}
 
     def get_realtime(self):
         """Outdated. Return the raw realtime data structure.
@@ -0,0 +1,234 @@
+import asyncio
+import bisect
+import sqlite3
+from datetime import datetime, timedelta, timezone, tzinfo
+from time import time
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import ciso8601
+import orjson
+
+from .sense_api import Scale
+from .sense_exceptions import SensePartialUpdateException
+from .sense_rate_limit import TokenBucket
+
+BACKFILL_CONCURRENCY = 4
+# Periods are only complete once fetched this long after they ended
+COMPLETE_GRACE = timedelta(hours=2)
+# Period starts are stored in UTC
+PERIOD_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def period_start(scale: Scale, dt: datetime, tz: Optional[tzinfo] = None) -> datetime:
+    """Return the start of the trend period of `scale` containing `dt`.
+    With `tz`, the period is that of the local time in `tz`; a naive `dt` is
+    taken to be in `tz`."""
+    if tz is not None:
+        dt = dt.astimezone(tz) if dt.tzinfo else dt.replace(tzinfo=tz)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if scale == Scale.DAY:
+        return day
+    if scale == Scale.WEEK:
+        return day - timedelta(days=day.weekday())
+    if scale == Scale.MONTH:
+        return day.replace(day=1)
+    if scale == Scale.YEAR:
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Backfill is not supported for {scale.name}")
+
+
+def next_period(scale: Scale, start: datetime) -> datetime:
+    """Return the start of the period after the one starting at `start`."""
+    if scale == Scale.DAY:
+        return start + timedelta(days=1)
+    if scale == Scale.WEEK:
+        return start + timedelta(weeks=1)
+    if scale == Scale.MONTH:
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    if scale == Scale.YEAR:
+        return start.replace(year=start.year + 1)
+    raise ValueError(f"Backfill is not supported for {scale.name}")
+
+
+def format_period(dt: datetime) -> str:
+    """Return the stored key of a period start."""
+    return dt.astimezone(timezone.utc).strftime(PERIOD_FORMAT)
+
+
+def parse_period(key: str) -> datetime:
+    """Return the period start of a stored key."""
+    return datetime.strptime(key, PERIOD_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def trend_periods(scale: Scale, start: datetime, end: datetime, tz: Optional[tzinfo] = None) -> list[datetime]:
+    """Return the starts of all periods of `scale` overlapping [start, end),
+    in `tz` if given."""
+    periods = []
+    period = period_start(scale, start, tz)
+    if tz is not None and end.tzinfo is None:
+        end = end.replace(tzinfo=tz)
+    while period < end:
+        periods.append(period)
+        period = next_period(scale, period)
+    return periods
+
+
+class TrendStore:
+    """Append-only SQLite store of trend periods.
+
+    Each fetch of a period is appended as a new row, keyed by the UTC start
+    the API returned for it; the newest row of a period is its current data.
+    A period is complete once it was fetched well after it ended, and
+    complete periods are not fetched again.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open or create the store."""
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS trends ("
+            " monitor_id TEXT NOT NULL, scale TEXT NOT NULL, start TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL, complete INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS trends_period ON trends (monitor_id, scale, start)")
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def add(self, monitor_id: str, scale: Scale, start: str, data: dict, complete: bool) -> None:
+        """Append a fetched period."""
+        self._db.execute(
+            "INSERT INTO trends VALUES (?, ?, ?, ?, ?, ?)",
+            (str(monitor_id), scale.name, start, time(), int(complete), orjson.dumps(data)),
+        )
+        self._db.commit()
+
+    def completed(self, monitor_id: str, scale: Scale) -> set[str]:
+        """Starts of the complete periods."""
+        rows = self._db.execute(
+            "SELECT DISTINCT start FROM trends WHERE monitor_id = ? AND scale = ? AND complete = 1",
+            (str(monitor_id), scale.name),
+        )
+        return {row[0] for row in rows}
+
+    def last_completed(self, monitor_id: str, scale: Scale) -> Optional[str]:
+        """Start of the newest complete period."""
+        row = self._db.execute(
+            "SELECT MAX(start) FROM trends WHERE monitor_id = ? AND scale = ? AND complete = 1",
+            (str(monitor_id), scale.name),
+        ).fetchone()
+        return row[0]
+
+    def get(self, monitor_id: str, scale: Scale, start: str) -> Optional[dict]:
+        """Newest data of a period."""
+        row = self._db.execute(
+            "SELECT data FROM trends WHERE monitor_id = ? AND scale = ? AND start = ?"
+            " ORDER BY fetched_at DESC LIMIT 1",
+            (str(monitor_id), scale.name, start),
+        ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def periods(self, monitor_id: str, scale: Scale) -> list[tuple[str, dict]]:
+        """Newest data of every stored period, oldest period first."""
+        rows = self._db.execute(
+            "SELECT start, data FROM trends t WHERE monitor_id = ? AND scale = ? AND fetched_at = ("
+            " SELECT MAX(fetched_at) FROM trends WHERE monitor_id = t.monitor_id"
+            " AND scale = t.scale AND start = t.start) ORDER BY start",
+            (str(monitor_id), scale.name),
+        )
+        return [(start, orjson.loads(data)) for start, data in rows]
+
+
+class TrendBackfill:
+    """Fetches historical trend periods of an ASyncSenseable into a TrendStore.
+
+    Periods are fetched concurrently, limited by `max_concurrency` and
+    `max_rate` requests per second, on top of the Sense object's own
+    `rate_limiter`. Periods already complete in the store
+    are skipped, so an interrupted run resumes where it stopped.
+
+    Periods follow the monitor's time zone, fetched with the monitor data if
+    not loaded yet. A period is marked complete only when fetched at least
+    `grace` after its local end.
+    """
+
+    def __init__(
+        self,
+        sense,
+        store: TrendStore,
+        max_concurrency: int = BACKFILL_CONCURRENCY,
+        max_rate: Optional[float] = None,
+        grace: timedelta = COMPLETE_GRACE,
+    ) -> None:
+        """Initialize the backfill."""
+        self.sense = sense
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.limiter = TokenBucket(max_rate) if max_rate else None
+        self.grace = grace
+
+    async def _time_zone(self) -> tzinfo:
+        """The monitor's time zone, UTC if it is unknown."""
+        if not self.sense.time_zone:
+            await self.sense.get_monitor_data()
+        return ZoneInfo(self.sense.time_zone) if self.sense.time_zone else timezone.utc
+
+    def _completed(self, monitor_id: str, scale: Scale, tz: tzinfo) -> list[tuple[datetime, datetime]]:
+        """Start and end of the complete periods, oldest first."""
+        starts = sorted(parse_period(key).astimezone(tz) for key in self.store.completed(monitor_id, scale))
+        return [(start, next_period(scale, start)) for start in starts]
+
+    async def run(self, scale: Scale, start: datetime, end: datetime = None) -> int:
+        """Fetch the periods of `scale` between `start` and `end` (default now)
+        that are not complete in the store. Returns the number of periods
+        fetched. Raises SensePartialUpdateException, keyed by period start, for
+        periods that failed; the others are stored.
+        Naive `start` and `end` are taken to be in the monitor's time zone."""
+        tz = await self._time_zone()
+        now = datetime.now(timezone.utc)
+        monitor_id = self.sense.sense_monitor_id
+        done = self._completed(monitor_id, scale, tz)
+        done_starts = [period[0] for period in done]
+
+        def is_done(period: datetime) -> bool:
+            # a stored period may not start where ours does, e.g. for another week start
+            i = bisect.bisect_right(done_starts, period) - 1
+            return i >= 0 and period < done[i][1]
+
+        todo = [p for p in trend_periods(scale, start, end or now, tz) if not is_done(p)]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch(period: datetime) -> None:
+            async with semaphore:
+                if self.limiter:
+                    await self.limiter.async_acquire()
+                data = await self.sense._fetch_trend_data(scale, period.astimezone(timezone.utc))
+            try:
+                # the API's own start of the period, in UTC
+                actual = ciso8601.parse_datetime(data["start"]).astimezone(tz)
+            except (KeyError, TypeError, ValueError):
+                actual = period
+            complete = next_period(scale, actual) + self.grace <= now
+            self.store.add(monitor_id, scale, format_period(actual), data, complete)
+
+        results = await asyncio.gather(*(fetch(period) for period in todo), return_exceptions=True)
+        errors = {}
+        for period, result in zip(todo, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+                errors[format_period(period)] = result
+        if errors:
+            raise SensePartialUpdateException(errors)
+        return len(todo)
+
+    async def update(self, scale: Scale, start: datetime) -> int:
+        """Fetch only what is new: the periods after the newest complete one in
+        the store, or from `start` if there is none."""
+        last = self.store.last_completed(self.sense.sense_monitor_id, scale)
+        if last:
+            tz = await self._time_zone()
+            start = next_period(scale, parse_period(last).astimezone(tz))
+        return await self.run(scale, start)
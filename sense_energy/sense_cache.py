@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from time import monotonic
+from typing import Any, Optional
+
+# Endpoints whose data changes rarely, with their time to live in seconds
+DEFAULT_TTLS = {
+    "app/monitors/*/overview": 300,
+    "app/monitors/*/devices/overview": 300,
+    "app/monitors/*/devices/always_on": 300,
+    "app/monitors/*/status": 60,
+}
+CACHE_SIZE = 256
+
+
+class CacheEntry:
+    """A cached API response."""
+
+    __slots__ = ("data", "etag", "expires")
+
+    def __init__(self, data: Any, etag: Optional[str], expires: float) -> None:
+        self.data = data
+        self.etag = etag
+        self.expires = expires
+
+    @property
+    def fresh(self) -> bool:
+        return monotonic() < self.expires
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of API responses with per-endpoint TTLs.
+
+    `ttls` maps endpoint patterns (shell-style, matched against the URL
+    without its query string) to seconds. Only matching endpoints are cached.
+    Expired entries that carried an ETag are kept so the request can be
+    revalidated with If-None-Match.
+    """
+
+    def __init__(self, ttls: Optional[dict[str, float]] = None, max_entries: int = CACHE_SIZE) -> None:
+        """Initialize the cache."""
+        self.ttls = DEFAULT_TTLS.copy() if ttls is None else ttls
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def ttl_for(self, url: str) -> Optional[float]:
+        """Return the TTL for an endpoint, or None if it is not cached."""
+        path = url.split("?", 1)[0]
+        for pattern, ttl in self.ttls.items():
+            if fnmatchcase(path, pattern):
+                return ttl
+        return None
+
+    @staticmethod
+    def _key(url: str, payload: Optional[dict]) -> tuple:
+        return (url, tuple(sorted(payload.items())) if payload else ())
+
+    def get(self, url: str, payload: Optional[dict] = None) -> Optional[CacheEntry]:
+        """Return the cached entry for a request, fresh or not.
+
+        Endpoints that are not cacheable return None without counting a miss.
+        """
+        if self.ttl_for(url) is None:
+            return None
+        key = self._key(url, payload)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if entry.fresh:
+            self.hits += 1
+        return entry
+
+    def set(self, url: str, payload: Optional[dict], data: Any, etag: Optional[str] = None) -> None:
+        """Store a response if its endpoint is cacheable."""
+        ttl = self.ttl_for(url)
+        if ttl is None:
+            return
+        self._store(self._key(url, payload), CacheEntry(data, etag, monotonic() + ttl))
+
+    def _store(self, key: tuple, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def refresh(self, url: str, payload: Optional[dict], entry: CacheEntry) -> Any:
+        """Extend an entry after the server confirmed it is unchanged (304)
+        and return its data.
+
+        `entry` is the one the request was revalidating; it is stored again if
+        it was invalidated or evicted while the request was in flight, unless
+        a newer response has been cached since.
+        """
+        entry.expires = monotonic() + (self.ttl_for(url) or 0)
+        key = self._key(url, payload)
+        if self._entries.get(key, entry) is entry:
+            self._store(key, entry)
+        self.revalidations += 1
+        return entry.data
+
+    def invalidate(self, pattern: Optional[str] = None) -> None:
+        """Drop cached entries whose URL matches the pattern, or all entries."""
+        if pattern is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if fnmatchcase(key[0].split("?", 1)[0], pattern)]:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -16,3 +16,20 @@ class SenseWebsocketException(Exception):
 
 class SenseAPIException(Exception):
     pass
+
+
+class SensePartialUpdateException(SenseAPIException):
+    """Raised when part of a multi-request update failed.
+    `errors` maps each failed part (e.g. a Scale) to its exception."""
+
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super().__init__("Update failed for: " + ", ".join(f"{k}: {v!r}" for k, v in errors.items()))
+
+
+class SenseRateLimitException(SenseAPIException):
+    """Raised when the API responds 429. `retry_after` is in seconds, if given."""
+
+    def __init__(self, retry_after=None):
+        self.retry_after = retry_after
+        super().__init__(f"API rate limited, retry after: {retry_after}")
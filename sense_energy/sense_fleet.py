@@ -0,0 +1,338 @@
+import asyncio
+import heapq
+import logging
+import multiprocessing
+import queue
+import random
+import zlib
+from time import monotonic
+from typing import Awaitable, Callable, Optional
+
+from .sense_api import RATE_LIMIT, SenseableBase
+from .sense_rate_limit import TokenBucket
+
+TREND_INTERVAL = 300
+FLEET_CONCURRENCY = 20
+SHARD_STATS_INTERVAL = 5
+SHARD_STOP_TIMEOUT = 30
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def shard_for(key: str, shards: int) -> int:
+    """Return the shard an account key belongs to. Stable across processes."""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+class FleetAccount:
+    """Polling state of a single account in a SenseFleet."""
+
+    __slots__ = ("key", "sense", "polls", "errors", "last_poll", "last_lag", "last_error")
+
+    def __init__(self, key: str, sense: SenseableBase) -> None:
+        self.key = key
+        self.sense = sense
+        self.polls = 0
+        self.errors = 0
+        self.last_poll = 0.0
+        self.last_lag = 0.0
+        self.last_error: Optional[Exception] = None
+
+
+class SenseFleet:
+    """Polls many Sense accounts from one event loop.
+
+    Each account's realtime and trend polls are given a random phase within
+    their interval so accounts don't poll in bursts. Polls are limited by a
+    global concurrency cap and a minimum interval between polls of the same
+    account. API requests and websocket connects of all accounts are limited
+    by a global budget of `max_rate` per second and a per-account budget of
+    `account_rate` per second, using TokenBuckets. Accounts can be
+    sharded across worker processes with `shard`/`shards`, see `run_sharded`.
+    """
+
+    def __init__(
+        self,
+        realtime_interval: float = RATE_LIMIT,
+        trend_interval: float = TREND_INTERVAL,
+        max_rate: Optional[float] = None,
+        account_rate: Optional[float] = None,
+        max_concurrency: int = FLEET_CONCURRENCY,
+        account_min_interval: float = 0,
+        shard: int = 0,
+        shards: int = 1,
+    ) -> None:
+        """Initialize the fleet."""
+        self.realtime_interval = realtime_interval
+        self.trend_interval = trend_interval
+        self.limiter = TokenBucket(max_rate) if max_rate else None
+        self.account_rate = account_rate
+        self.account_min_interval = account_min_interval
+        self.shard = shard
+        self.shards = shards
+        self._accounts: dict[str, FleetAccount] = {}
+        self._schedule: list[tuple[float, int, str, str]] = []
+        self._seq = 0
+        self.max_concurrency = max_concurrency
+        # created in start, so they belong to the loop the fleet runs on
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: set[asyncio.Task] = set()
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._polls = 0
+        self._errors = 0
+
+    def owns(self, key: str) -> bool:
+        """True if the account key belongs to this fleet's shard."""
+        return shard_for(key, self.shards) == self.shard
+
+    def add(self, key: str, sense: SenseableBase) -> bool:
+        """Add an authenticated account to the fleet.
+        Returns False if the key belongs to another shard."""
+        if not self.owns(key):
+            return False
+        # the fleet owns poll timing, so the per-instance rate limit is not needed
+        sense.rate_limit = 0
+        if self.account_rate:
+            sense.rate_limiter = TokenBucket(self.account_rate, parent=self.limiter)
+        elif self.limiter:
+            sense.rate_limiter = self.limiter
+        self._accounts[key] = FleetAccount(key, sense)
+        now = monotonic()
+        if self.realtime_interval:
+            self._push(now + random.uniform(0, self.realtime_interval), key, "realtime")
+        if self.trend_interval:
+            self._push(now + random.uniform(0, self.trend_interval), key, "trend")
+        return True
+
+    def remove(self, key: str) -> None:
+        """Remove an account from the fleet. Pending polls are dropped."""
+        self._accounts.pop(key, None)
+
+    @property
+    def accounts(self) -> list[SenseableBase]:
+        """The Sense objects polled by this fleet."""
+        return [account.sense for account in self._accounts.values()]
+
+    @property
+    def stats(self) -> dict:
+        """Aggregate progress and lag of the fleet. Lag is the delay in seconds
+        between when a poll was due and when it started."""
+        now = monotonic()
+        overdue = [now - due for due, _, key, _ in self._schedule if due < now and key in self._accounts]
+        return {
+            "accounts": len(self._accounts),
+            "polls": self._polls,
+            "errors": self._errors,
+            "in_flight": len(self._in_flight),
+            "pending_overdue": len(overdue),
+            "lag_mean": self._lag_total / self._polls if self._polls else 0.0,
+            "lag_max": self._lag_max,
+            "lag_current": max(overdue, default=0.0),
+            "budget": self.limiter.budget if self.limiter else None,
+        }
+
+    def account_stats(self, key: str) -> dict:
+        """Progress of a single account."""
+        account = self._accounts[key]
+        return {
+            "polls": account.polls,
+            "errors": account.errors,
+            "last_lag": account.last_lag,
+            "last_error": account.last_error,
+            "budget": account.sense.rate_limiter.budget if account.sense.rate_limiter else None,
+        }
+
+    async def start(self) -> None:
+        """Start polling."""
+        if self._task and not self._task.done():
+            return
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop polling and wait for in-flight polls to finish."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def _push(self, due: float, key: str, kind: str) -> None:
+        self._seq += 1
+        heapq.heappush(self._schedule, (due, self._seq, key, kind))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        """Scheduler loop: start polls as they become due."""
+        while True:
+            if not self._schedule:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, key, kind = self._schedule[0]
+            now = monotonic()
+            if due > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._schedule)
+            account = self._accounts.get(key)
+            if account is None:
+                continue
+            earliest = account.last_poll + self.account_min_interval
+            if earliest > now:
+                self._push(earliest, key, kind)
+                continue
+            await self._semaphore.acquire()
+            account.last_poll = monotonic()
+            task = asyncio.create_task(self._poll(account, kind, due))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _poll(self, account: FleetAccount, kind: str, due: float) -> None:
+        """Run one poll of an account and schedule the next one."""
+        lag = account.last_poll - due
+        account.last_lag = lag
+        self._lag_total += lag
+        self._lag_max = max(self._lag_max, lag)
+        self._polls += 1
+        account.polls += 1
+        try:
+            if kind == "realtime":
+                await _call(account.sense.update_realtime)
+            else:
+                await _call(account.sense.update_trend_data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            account.errors += 1
+            account.last_error = ex
+            self._errors += 1
+            _LOGGER.debug("Poll %s of %s failed: %s", kind, account.key, ex)
+        finally:
+            self._semaphore.release()
+        if account.key in self._accounts:
+            interval = self.realtime_interval if kind == "realtime" else self.trend_interval
+            # keep the account's phase unless it fell a whole interval behind
+            self._push(max(due + interval, monotonic()), account.key, kind)
+
+
+async def _call(method: Callable) -> None:
+    """Call an update method of either client, keeping sync clients off the loop."""
+    if asyncio.iscoroutinefunction(method):
+        await method()
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, method)
+
+
+async def _run_shard(
+    setup: Callable[[SenseFleet], Awaitable[None]],
+    fleet_kwargs: dict,
+    stop,
+    stats: multiprocessing.Queue,
+    stats_interval: float,
+) -> None:
+    fleet = SenseFleet(**fleet_kwargs)
+    await setup(fleet)
+    await fleet.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while not await loop.run_in_executor(None, stop.wait, stats_interval):
+            stats.put((fleet.shard, fleet.stats))
+    finally:
+        await fleet.stop()
+        stats.put((fleet.shard, fleet.stats))
+
+
+def _shard_main(setup, fleet_kwargs: dict, stop, stats: multiprocessing.Queue, stats_interval: float) -> None:
+    asyncio.run(_run_shard(setup, fleet_kwargs, stop, stats, stats_interval))
+
+
+class ShardedFleet:
+    """Worker processes started by `run_sharded`, each running a SenseFleet.
+
+    Workers report their fleet's stats every `stats_interval` seconds; `stats`
+    aggregates the latest report of every shard. `stop` stops the workers.
+    """
+
+    def __init__(self, processes: list[multiprocessing.Process], stop, stats: multiprocessing.Queue) -> None:
+        self.processes = processes
+        self._stop = stop
+        self._stats_queue = stats
+        self._shard_stats: dict[int, dict] = {}
+
+    def shard_stats(self) -> dict[int, dict]:
+        """Latest reported stats of each shard."""
+        while True:
+            try:
+                shard, stats = self._stats_queue.get_nowait()
+            except queue.Empty:
+                return self._shard_stats
+            self._shard_stats[shard] = stats
+
+    @property
+    def stats(self) -> dict:
+        """Aggregate progress and lag of all shards, as of their latest reports."""
+        shards = list(self.shard_stats().values())
+        polls = sum(s["polls"] for s in shards)
+        return {
+            "shards": len(shards),
+            "accounts": sum(s["accounts"] for s in shards),
+            "polls": polls,
+            "errors": sum(s["errors"] for s in shards),
+            "in_flight": sum(s["in_flight"] for s in shards),
+            "pending_overdue": sum(s["pending_overdue"] for s in shards),
+            "lag_mean": sum(s["lag_mean"] * s["polls"] for s in shards) / polls if polls else 0.0,
+            "lag_max": max((s["lag_max"] for s in shards), default=0.0),
+            "lag_current": max((s["lag_current"] for s in shards), default=0.0),
+        }
+
+    def stop(self, timeout: Optional[float] = SHARD_STOP_TIMEOUT) -> None:
+        """Stop the workers, waiting up to `timeout` seconds for in-flight polls
+        before terminating them, and collect their final stats."""
+        self._stop.set()
+        deadline = None if timeout is None else monotonic() + timeout
+        for process in self.processes:
+            # keep draining reports, a worker exits only once its queued reports are flushed
+            while process.is_alive() and (deadline is None or monotonic() < deadline):
+                self.shard_stats()
+                process.join(0.1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.shard_stats()
+
+
+def run_sharded(
+    setup: Callable[[SenseFleet], Awaitable[None]],
+    shards: int,
+    stats_interval: float = SHARD_STATS_INTERVAL,
+    **fleet_kwargs,
+) -> ShardedFleet:
+    """Start `shards` worker processes, each running a SenseFleet for one shard.
+    `setup` is a picklable coroutine function called with the fleet in each
+    worker; it should create and add accounts, which `add` filters to the
+    worker's shard. Returns a ShardedFleet to collect stats from and stop the workers."""
+    stop = multiprocessing.Event()
+    stats = multiprocessing.Queue()
+    processes = []
+    for shard in range(shards):
+        kwargs = dict(fleet_kwargs, shard=shard, shards=shards)
+        process = multiprocessing.Process(
+            target=_shard_main, args=(setup, kwargs, stop, stats, stats_interval), daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return ShardedFleet(processes, stop, stats)
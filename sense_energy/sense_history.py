@@ -0,0 +1,201 @@
+from array import array
+from time import time
+from typing import Optional
+
+# NumPy, if installed, imported by the first RealtimeHistory so that importing
+# the package does not load it
+np = None
+_numpy_checked = False
+
+HISTORY_CAPACITY = 3600
+HISTORY_DEVICES = 64
+VOLTAGE_LEGS = 2
+FIELDS = ("w", "solar_w", "hz")
+
+
+def _import_numpy() -> None:
+    global np, _numpy_checked
+    if _numpy_checked:
+        return
+    _numpy_checked = True
+    try:
+        import numpy
+
+        np = numpy
+    except ImportError:
+        pass
+
+
+class RealtimeHistory:
+    """Fixed-memory ring buffer of realtime frames.
+
+    Holds timestamps, total and solar power, frequency, voltage per leg and
+    per-device power for the last `capacity` frames in preallocated numeric
+    arrays, NumPy arrays when available. Devices beyond `max_devices` are not
+    recorded. Window queries take the number of seconds before the newest
+    frame to include, or None for the whole buffer.
+    """
+
+    def __init__(self, capacity: int = HISTORY_CAPACITY, max_devices: int = HISTORY_DEVICES) -> None:
+        """Initialize the buffer."""
+        _import_numpy()
+        self.capacity = capacity
+        self.max_devices = max_devices
+        # device readings not recorded because max_devices was reached
+        self.dropped_devices = 0
+        self._next = 0
+        self._size = 0
+        self._device_columns: dict[str, int] = {}
+        self._columns = {name: self._zeros(capacity) for name in ("time",) + FIELDS}
+        self._voltage = [self._zeros(capacity) for _ in range(VOLTAGE_LEGS)]
+        if np is not None:
+            self._devices = np.zeros((capacity, max_devices))
+        else:
+            self._devices = []
+
+    @staticmethod
+    def _zeros(size: int):
+        if np is not None:
+            return np.zeros(size)
+        return array("d", bytes(8 * size))
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the sample arrays."""
+        columns = len(self._columns) + VOLTAGE_LEGS + self.max_devices
+        return 8 * self.capacity * columns
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, data: dict, timestamp: Optional[float] = None) -> None:
+        """Record a realtime frame."""
+        i = self._next
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+        columns = self._columns
+        columns["time"][i] = timestamp or data.get("epoch") or time()
+        for name in FIELDS:
+            columns[name][i] = data.get(name) or 0.0
+        voltage = data.get("voltage") or ()
+        for leg, column in enumerate(self._voltage):
+            column[i] = voltage[leg] if leg < len(voltage) else 0.0
+
+        if np is not None:
+            self._devices[i] = 0.0
+        else:
+            for column in self._devices:
+                column[i] = 0.0
+        for d in data.get("devices", ()):
+            col = self._device_columns.get(d["id"])
+            if col is None:
+                col = self._add_device(d["id"])
+                if col is None:
+                    continue
+            if np is not None:
+                self._devices[i, col] = d["w"]
+            else:
+                self._devices[col][i] = d["w"]
+
+    def _add_device(self, id: str) -> Optional[int]:
+        if len(self._device_columns) >= self.max_devices:
+            self.dropped_devices += 1
+            return None
+        col = self._device_columns[id] = len(self._device_columns)
+        if np is None:
+            self._devices.append(self._zeros(self.capacity))
+        return col
+
+    @property
+    def device_ids(self) -> list[str]:
+        """Ids of the devices being recorded."""
+        return list(self._device_columns)
+
+    def _order(self):
+        """Buffer indices of the stored frames, oldest first."""
+        start = (self._next - self._size) % self.capacity
+        if np is not None:
+            return (np.arange(self._size) + start) % self.capacity
+        return [(start + k) % self.capacity for k in range(self._size)]
+
+    def _column(self, field: str, device: Optional[str]):
+        if device is not None:
+            col = self._device_columns.get(device)
+            if col is None:
+                raise KeyError(device)
+            return self._devices[:, col] if np is not None else self._devices[col]
+        if field == "voltage":
+            if np is not None:
+                return sum(self._voltage) / VOLTAGE_LEGS
+            return array("d", (sum(legs) / VOLTAGE_LEGS for legs in zip(*self._voltage)))
+        return self._columns[field]
+
+    def window(self, field: str = "w", seconds: Optional[float] = None, device: Optional[str] = None):
+        """Return (timestamps, values) of a field, oldest first.
+        `field` is "w", "solar_w", "hz" or "voltage" (mean of the legs);
+        pass `device` to get the power of a single device instead."""
+        order = self._order()
+        times = self._columns["time"]
+        column = self._column(field, device)
+        if np is not None:
+            ts, values = times[order], column[order]
+            if seconds is not None and self._size:
+                mask = ts >= ts[-1] - seconds
+                ts, values = ts[mask], values[mask]
+            return ts, values
+        ts = [times[i] for i in order]
+        values = [column[i] for i in order]
+        if seconds is not None and ts:
+            cutoff = ts[-1] - seconds
+            first = next(k for k, t in enumerate(ts) if t >= cutoff)
+            ts, values = ts[first:], values[first:]
+        return ts, values
+
+    def mean(self, field: str = "w", seconds: Optional[float] = None, device: Optional[str] = None) -> float:
+        """Mean of a field over the window."""
+        _, values = self.window(field, seconds, device)
+        if not len(values):
+            return 0.0
+        return float(values.mean()) if np is not None else sum(values) / len(values)
+
+    def min(self, field: str = "w", seconds: Optional[float] = None, device: Optional[str] = None) -> float:
+        """Minimum of a field over the window."""
+        _, values = self.window(field, seconds, device)
+        if not len(values):
+            return 0.0
+        return float(values.min()) if np is not None else min(values)
+
+    def max(self, field: str = "w", seconds: Optional[float] = None, device: Optional[str] = None) -> float:
+        """Maximum of a field over the window."""
+        _, values = self.window(field, seconds, device)
+        if not len(values):
+            return 0.0
+        return float(values.max()) if np is not None else max(values)
+
+    def percentile(
+        self, q: float, field: str = "w", seconds: Optional[float] = None, device: Optional[str] = None
+    ) -> float:
+        """Percentile (0-100) of a field over the window, linearly interpolated."""
+        _, values = self.window(field, seconds, device)
+        if not len(values):
+            return 0.0
+        if np is not None:
+            return float(np.percentile(values, q))
+        values = sorted(values)
+        pos = (len(values) - 1) * q / 100
+        low = int(pos)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (pos - low)
+
+    def energy_wh(self, field: str = "w", seconds: Optional[float] = None, device: Optional[str] = None) -> float:
+        """Energy in Wh of a power field over the window (trapezoidal integral)."""
+        ts, values = self.window(field, seconds, device)
+        if len(values) < 2:
+            return 0.0
+        if np is not None:
+            return float(((values[1:] + values[:-1]) * np.diff(ts)).sum() / 2 / 3600)
+        total = 0.0
+        for k in range(1, len(values)):
+            total += (values[k] + values[k - 1]) * (ts[k] - ts[k - 1])
+        return total / 2 / 3600
@@ -5,27 +5,78 @@
 
 import asyncio
 import logging
+import multiprocessing
+from collections import OrderedDict
+from time import monotonic
 from typing import Optional, Union
 
 import orjson
 from kasa_crypt import decrypt as tp_link_decrypt
-from kasa_crypt import encrypt as tp_link_encrypt
 
 from .plug_instance import PlugInstance
+from .sense_rate_limit import TokenBucket
 
 SENSE_TP_LINK_PORT = 9999
+DEFAULT_BATCH_SIZE = 256
+REQUEST_CACHE_SIZE = 64
+MAX_SOURCES = 1024
+PUBLISH_INTERVAL = 1.0
+WORKER_POLL_INTERVAL = 0.2
+WORKER_START_TIMEOUT = 30
+WORKER_STOP_TIMEOUT = 5
+
+REQUEST_DISCOVERY = "discovery"
+REQUEST_ECHO = "echo"
+REQUEST_INVALID = "invalid"
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class SenseLinkServerProtocol:
-    """Class to represent a SenseLink server."""
+    """Class to represent a SenseLink server.
+
+    With a `batch_size` of 1 or more, responses to a broadcast are sent that
+    many at a time, one batch per event loop iteration, so other tasks keep
+    running during the fan-out. With `devices_ttl`, the `devices` callable is evaluated at
+    most once per that many seconds instead of on every broadcast.
+
+    To survive broadcast storms, `dedupe_window` ignores requests from a source
+    address that already got answered within that many seconds, and
+    `source_rate` limits each source address to that many answered requests
+    per second. Suppressed requests are counted in `stats`.
+    """
 
-    def __init__(self, devices: callable) -> None:
+    def __init__(
+        self,
+        devices: callable,
+        batch_size: Optional[int] = None,
+        devices_ttl: float = 0,
+        dedupe_window: float = 0,
+        source_rate: Optional[float] = None,
+    ) -> None:
         """Initialize the SenseLink server."""
         self._devices = devices
+        self.batch_size = batch_size
+        self.devices_ttl = devices_ttl
+        self.dedupe_window = dedupe_window
+        self.source_rate = source_rate
         self.should_respond = True
         self.transport: Optional[asyncio.DatagramTransport] = None
+        self.stats = dict.fromkeys(("requests", "answered", "echo", "invalid", "duplicate", "rate_limited"), 0)
+        self._plugs: Optional[list[PlugInstance]] = None
+        self._plugs_time = 0.0
+        # request bytes -> REQUEST_* kind, so repeated requests are not decrypted again
+        self._request_kinds: dict[bytes, str] = {}
+        # source host -> time of its last request, least recently seen first
+        self._sources: OrderedDict[str, float] = OrderedDict()
+        # source host -> time its last request was answered
+        self._answered: dict[str, float] = {}
+        self._source_buckets: dict[str, TokenBucket] = {}
+
+    @property
+    def suppressed(self) -> int:
+        """Valid requests that were not answered: echoes, duplicates and rate limited."""
+        return self.stats["echo"] + self.stats["duplicate"] + self.stats["rate_limited"]
 
     def connection_made(self, transport: asyncio.DatagramTransport) -> None:
         """Handle new connection."""
@@ -37,63 +88,204 @@ class SenseLinkServerProtocol:
 
     def datagram_received(self, data: bytes, addr: Union[tuple[str, int], tuple[str, int, int, int]]) -> None:
         """Handle incoming UDP datagram."""
+        self.stats["requests"] += 1
+        kind = self._request_kinds.get(data)
+        if kind is None:
+            kind = self._classify_request(data, addr)
+            if len(self._request_kinds) >= REQUEST_CACHE_SIZE:
+                self._request_kinds.clear()
+            self._request_kinds[data] = kind
+        if kind != REQUEST_DISCOVERY:
+            self.stats[kind] += 1
+            return
+        if not self._allow_source(addr[0]):
+            return
+
+        logging.debug(f"Broadcast received from {addr}")
+        plugs = self._current_plugs()
+        # Allow disabling response
+        if self.should_respond:
+            self._send_responses(plugs, 0, addr)
+        else:
+            # Do not send response, but log for debugging
+            for plug in plugs:
+                _LOGGER.debug("SENSE_RESPONSE disabled, response content: %s", plug.generate_response())
+
+    def _classify_request(self, data: bytes, addr) -> str:
+        """Decrypt and check a request, returning its REQUEST_* kind."""
         try:
             decrypted_data = tp_link_decrypt(data)
         except UnicodeDecodeError:
             _LOGGER.debug(f"Failed to decrypt data from {addr}")
-            return
+            return REQUEST_INVALID
 
         try:
             json_data = orjson.loads(decrypted_data)
-            # Sense requests the emeter and system parameters
-            if (
-                "emeter" in json_data
-                and "get_realtime" in json_data["emeter"]
-                and "system" in json_data
-                and "get_sysinfo" in json_data["system"]
-            ):
-                # Check for non-empty values, to prevent echo storms
-                if json_data["emeter"]["get_realtime"]:
-                    # This is a self-echo, common with Docker without --net=Host!
-                    logging.debug("Ignoring non-empty/non-Sense UDP request")
-                    return
-
-                logging.debug(f"Broadcast received from {addr}: {json_data}")
-
-                # Build and send responses
-                for plug in self._devices():
-                    # Build response
-                    response = plug.generate_response()
-                    json_resp = orjson.dumps(response)
-                    encrypted_resp = tp_link_encrypt(json_resp.decode("utf-8"))
-                    # Strip leading 4 bytes for...some reason
-                    encrypted_resp = encrypted_resp[4:]
-
-                    # Allow disabling response
-                    if self.should_respond:
-                        # Send response
-                        logging.debug("Sending response: %s", response)
-                        self.transport.sendto(encrypted_resp, addr)
-                    else:
-                        # Do not send response, but log for debugging
-                        _LOGGER.debug("SENSE_RESPONSE disabled, response content: %s", response)
-            else:
-                _LOGGER.debug(f"Ignoring non-emeter JSON from %s: %s", addr, json_data)
-
         # Appears to not be JSON
         except ValueError:
             _LOGGER.debug("Did not receive valid json")
+            return REQUEST_INVALID
+
+        # Sense requests the emeter and system parameters
+        if not (
+            isinstance(json_data, dict)
+            and "emeter" in json_data
+            and "get_realtime" in json_data["emeter"]
+            and "system" in json_data
+            and "get_sysinfo" in json_data["system"]
+        ):
+            _LOGGER.debug(f"Ignoring non-emeter JSON from %s: %s", addr, json_data)
+            return REQUEST_INVALID
+
+        # Check for non-empty values, to prevent echo storms
+        if json_data["emeter"]["get_realtime"]:
+            # This is a self-echo, common with Docker without --net=Host!
+            logging.debug("Ignoring non-empty/non-Sense UDP request")
+            return REQUEST_ECHO
+        return REQUEST_DISCOVERY
+
+    def _allow_source(self, host: str) -> bool:
+        """Apply the dedupe window and rate limit of a source host."""
+        if not (self.dedupe_window or self.source_rate):
+            self.stats["answered"] += 1
+            return True
+        now = monotonic()
+        self._seen(host, now)
+        if self.dedupe_window:
+            last = self._answered.get(host)
+            if last is not None and now - last < self.dedupe_window:
+                self.stats["duplicate"] += 1
+                return False
+        if self.source_rate:
+            bucket = self._source_buckets.get(host)
+            if bucket is None:
+                bucket = self._source_buckets[host] = TokenBucket(self.source_rate, max(1.0, self.source_rate))
+            if not bucket.try_acquire():
+                self.stats["rate_limited"] += 1
+                return False
+        self._answered[host] = now
+        self.stats["answered"] += 1
+        return True
+
+    def _seen(self, host: str, now: float) -> None:
+        """Record a request of a source host. Beyond MAX_SOURCES hosts, e.g. with
+        spoofed addresses, the state of the least recently seen one is dropped,
+        so active sources keep their dedupe time and rate limit."""
+        sources = self._sources
+        sources[host] = now
+        sources.move_to_end(host)
+        if len(sources) > MAX_SOURCES:
+            stale, _ = sources.popitem(last=False)
+            self._answered.pop(stale, None)
+            self._source_buckets.pop(stale, None)
+
+    def _current_plugs(self) -> list[PlugInstance]:
+        """The plugs to respond for, evaluating `devices` at most every `devices_ttl` seconds."""
+        now = monotonic()
+        if self._plugs is None or now - self._plugs_time >= self.devices_ttl:
+            self._plugs = list(self._devices())
+            self._plugs_time = now
+        return self._plugs
+
+    def _send_responses(self, plugs: list[PlugInstance], start: int, addr) -> None:
+        """Send each plug's cached encrypted response, scheduling the plugs after
+        the first `batch_size` on the next event loop iteration."""
+        if self.transport is None or self.transport.is_closing():
+            return
+        batch_size = int(self.batch_size or 0)
+        # None or a size below 1 sends everything at once
+        end = min(start + batch_size, len(plugs)) if batch_size >= 1 else len(plugs)
+        sendto = self.transport.sendto
+        for i in range(start, end):
+            sendto(plugs[i].encrypted_response(), addr)
+        if end < len(plugs):
+            asyncio.get_running_loop().call_soon(self._send_responses, plugs, end, addr)
+
+
+def _serve_worker(port: int, index: int, workers: int, specs: list, values, stop, ready, options: dict) -> None:
+    """Process entry point of a SenseLink worker."""
+    asyncio.run(_run_worker(port, index, workers, specs, values, stop, ready, options))
+
+
+async def _run_worker(port: int, index: int, workers: int, specs: list, values, stop, ready, options: dict) -> None:
+    """Answer broadcasts for every `workers`th plug starting at `index`, reading
+    power, current and voltage from the shared `values` array."""
+    shares = [(i, PlugInstance(*spec)) for i, spec in enumerate(specs) if i % workers == index]
+    plugs = [plug for _, plug in shares]
+
+    def devices() -> list[PlugInstance]:
+        # only assign changes, assignments clear a plug's encrypted response cache
+        for i, plug in shares:
+            power, current, voltage = values[3 * i : 3 * i + 3]
+            if plug.power != power:
+                plug.power = power
+            if plug.current != current:
+                plug.current = current
+            if plug.voltage != voltage:
+                plug.voltage = voltage
+        return plugs
+
+    loop = asyncio.get_running_loop()
+    try:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: SenseLinkServerProtocol(devices, **options), local_addr=("0.0.0.0", port), reuse_port=True
+        )
+    except (OSError, ValueError) as ex:
+        ready.put((index, repr(ex)))
+        return
+    ready.put((index, None))
+    try:
+        while not stop.is_set():
+            await asyncio.sleep(WORKER_POLL_INTERVAL)
+    finally:
+        transport.close()
 
 
 class SenseLink:
-    """Class to represent a SenseLink server."""
+    """Class to represent a SenseLink server.
+
+    For thousands of plugs, set `batch_size` (e.g. DEFAULT_BATCH_SIZE) to spread
+    responses over event loop iterations and `devices_ttl` to avoid rebuilding
+    the plug list on every broadcast. Set `dedupe_window` and `source_rate` to
+    limit how often each source is answered during broadcast storms. See
+    SenseLinkServerProtocol.
+
+    With `workers` above 1, `start` runs that many processes bound to the port
+    with SO_REUSEPORT. A broadcast reaches every one of them, and each answers
+    for its share of the plugs, so one broadcast is handled on all cores. The
+    plugs are those returned by `devices` at start; their power, current and
+    voltage are published to the workers through shared memory every
+    `publish_interval` seconds. Unicast requests reach a single worker and are
+    answered only for its share, so use workers where Sense discovers plugs by
+    broadcast. Workers are started with the "spawn" method, so the main module
+    must be importable (guarded by `if __name__ == "__main__"`).
+    """
 
     _devices = []
 
-    def __init__(self, devices: callable, port=SENSE_TP_LINK_PORT) -> None:
+    def __init__(
+        self,
+        devices: callable,
+        port=SENSE_TP_LINK_PORT,
+        batch_size: Optional[int] = None,
+        devices_ttl: float = 0,
+        dedupe_window: float = 0,
+        source_rate: Optional[float] = None,
+        workers: int = 1,
+        publish_interval: float = PUBLISH_INTERVAL,
+    ) -> None:
         """Initialize the SenseLink server."""
         self.port = port
         self._devices = devices
+        self.batch_size = batch_size
+        self.devices_ttl = devices_ttl
+        self.dedupe_window = dedupe_window
+        self.source_rate = source_rate
+        self.workers = workers
+        self.publish_interval = publish_interval
+        self._worker_processes: list[multiprocessing.Process] = []
+        self._publisher: Optional[asyncio.Task] = None
+        self._stop_workers = None
 
     def print_instance_wattages(self) -> None:
         """Log the current wattages of all instances."""
@@ -102,11 +294,94 @@ class SenseLink:
 
     async def start(self) -> None:
         """Start the SenseLink server."""
+        if self.workers > 1:
+            await self._start_workers()
+            return
         loop = asyncio.get_running_loop()
         self.transport, self.protocol = await loop.create_datagram_endpoint(
-            lambda: SenseLinkServerProtocol(self._devices), local_addr=("0.0.0.0", self.port)
+            lambda: SenseLinkServerProtocol(
+                self._devices, self.batch_size, self.devices_ttl, self.dedupe_window, self.source_rate
+            ),
+            local_addr=("0.0.0.0", self.port),
         )
 
+    async def _start_workers(self) -> None:
+        """Start the worker processes and the task publishing plug power to them."""
+        if not self.port:
+            raise ValueError("SenseLink workers need a fixed port")
+        ctx = multiprocessing.get_context("spawn")
+        plugs = list(self._devices())
+        self._plug_index = {plug.id: i for i, plug in enumerate(plugs)}
+        self._values = ctx.Array("d", 3 * len(plugs), lock=False)
+        self._publish(plugs)
+        self._stop_workers = ctx.Event()
+        ready = ctx.Queue()
+        specs = [(p.id, p.start_time, p.alias, p.power, p.current, p.voltage, p.mac, p.device_id) for p in plugs]
+        options = {
+            "batch_size": self.batch_size,
+            "devices_ttl": self.devices_ttl,
+            "dedupe_window": self.dedupe_window,
+            "source_rate": self.source_rate,
+        }
+        self._worker_processes = [
+            ctx.Process(
+                target=_serve_worker,
+                args=(self.port, i, self.workers, specs, self._values, self._stop_workers, ready, options),
+                name=f"senselink-{i}",
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        for process in self._worker_processes:
+            process.start()
+
+        loop = asyncio.get_running_loop()
+        errors = []
+        try:
+            for _ in self._worker_processes:
+                _, error = await loop.run_in_executor(None, ready.get, True, WORKER_START_TIMEOUT)
+                if error:
+                    errors.append(error)
+        except Exception as ex:
+            errors.append(repr(ex))
+        if errors:
+            await self.stop()
+            raise OSError(f"SenseLink workers failed to start: {errors[0]}")
+        self._publisher = asyncio.create_task(self._publish_loop())
+
+    def _publish(self, plugs) -> None:
+        """Write power, current and voltage of the plugs to the workers' shared memory.
+        Plugs that were not present at start are ignored."""
+        values = self._values
+        for plug in plugs:
+            i = self._plug_index.get(plug.id)
+            if i is not None:
+                values[3 * i : 3 * i + 3] = [plug.power, plug.current, plug.voltage]
+
+    async def _publish_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            try:
+                self._publish(self._devices())
+            except Exception:
+                _LOGGER.exception("Failed to publish plug power to SenseLink workers")
+
     async def stop(self) -> None:
         """Stop the SenseLink server."""
-        self.transport.close()
+        if self.workers <= 1:
+            transport = getattr(self, "transport", None)
+            if transport is not None:
+                transport.close()
+            return
+        if self._publisher:
+            self._publisher.cancel()
+            self._publisher = None
+        if self._stop_workers is not None:
+            self._stop_workers.set()
+        loop = asyncio.get_running_loop()
+        for process in self._worker_processes:
+            await loop.run_in_executor(None, process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+        self._worker_processes = []
@@ -0,0 +1,169 @@
+import re
+import threading
+from bisect import bisect_left
+from typing import Any, Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROCESSING_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05)
+STALENESS_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30)
+
+_ID_SEGMENT = re.compile(r"[^/]*\d[^/]*")
+
+
+def endpoint_name(url: str) -> str:
+    """Endpoint of an API url with ids replaced, e.g. app/monitors/{id}/overview."""
+    return _ID_SEGMENT.sub("{id}", url.split("?", 1)[0])
+
+
+class MetricsSink:
+    """Receives measurements of API calls and the realtime stream.
+
+    This base class ignores everything; subclass it and assign an instance to
+    `sense.metrics` to record. With the default of no sink, nothing is
+    measured at all.
+    """
+
+    def api_call(self, endpoint: str, status: Optional[int], duration: float, attempt: int) -> None:
+        """A GET request finished; status is None if it failed without a response."""
+
+    def ws_connect(self, duration: float) -> None:
+        """A realtime websocket connection was opened."""
+
+    def frame(self, staleness: Optional[float]) -> None:
+        """A realtime frame arrived; staleness is receipt time minus the server epoch."""
+
+    def processing(self, stage: str, duration: float) -> None:
+        """Local processing finished: "decode", "set_realtime" or "device_trends"."""
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class PrometheusMetrics(MetricsSink):
+    """Aggregates measurements in memory and renders them in the Prometheus
+    text exposition format with `render`."""
+
+    def __init__(self, prefix: str = "sense") -> None:
+        """Initialize the metrics."""
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # name -> (help, label names, buckets, {label values: histogram})
+        self._histograms: dict[str, tuple[str, tuple, tuple, dict]] = {
+            "api_request_seconds": ("API GET latency", ("endpoint", "status"), LATENCY_BUCKETS, {}),
+            "websocket_connect_seconds": ("Realtime websocket connect time", (), LATENCY_BUCKETS, {}),
+            "frame_staleness_seconds": ("Realtime frame age on receipt", (), STALENESS_BUCKETS, {}),
+            "processing_seconds": ("Local processing time", ("stage",), PROCESSING_BUCKETS, {}),
+        }
+        self._counters: dict[str, tuple[str, tuple, dict]] = {
+            "api_retries_total": ("API GET retries", ("endpoint",), {}),
+            "frames_total": ("Realtime frames received", (), {}),
+        }
+
+    def _observe(self, name: str, labels: tuple, value: float) -> None:
+        _, _, buckets, series = self._histograms[name]
+        with self._lock:
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def _inc(self, name: str, labels: tuple = ()) -> None:
+        series = self._counters[name][2]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + 1
+
+    def api_call(self, endpoint: str, status: Optional[int], duration: float, attempt: int) -> None:
+        self._observe("api_request_seconds", (endpoint, status or "error"), duration)
+        if attempt:
+            self._inc("api_retries_total", (endpoint,))
+
+    def ws_connect(self, duration: float) -> None:
+        self._observe("websocket_connect_seconds", (), duration)
+
+    def frame(self, staleness: Optional[float]) -> None:
+        self._inc("frames_total")
+        if staleness is not None:
+            self._observe("frame_staleness_seconds", (), staleness)
+
+    def processing(self, stage: str, duration: float) -> None:
+        self._observe("processing_seconds", (stage,), duration)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, (help, label_names, buckets, series) in self._histograms.items():
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        le = f'le="{bound}"'
+                        lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(label_names, labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(label_names, labels)} {histogram.count}")
+            for name, (help, label_names, series) in self._counters.items():
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_labels(label_names, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryMetrics(MetricsSink):
+    """Records measurements with an OpenTelemetry `Meter`, e.g.
+    `opentelemetry.metrics.get_meter("sense_energy")`."""
+
+    def __init__(self, meter: Any) -> None:
+        """Create the instruments on the meter."""
+        self._api = meter.create_histogram("sense.api.request.duration", unit="s", description="API GET latency")
+        self._retries = meter.create_counter("sense.api.retries", description="API GET retries")
+        self._connect = meter.create_histogram(
+            "sense.websocket.connect.duration", unit="s", description="Realtime websocket connect time"
+        )
+        self._frames = meter.create_counter("sense.realtime.frames", description="Realtime frames received")
+        self._staleness = meter.create_histogram(
+            "sense.realtime.frame.staleness", unit="s", description="Realtime frame age on receipt"
+        )
+        self._processing = meter.create_histogram(
+            "sense.processing.duration", unit="s", description="Local processing time"
+        )
+
+    def api_call(self, endpoint: str, status: Optional[int], duration: float, attempt: int) -> None:
+        attributes = {"endpoint": endpoint, "status": status or "error"}
+        self._api.record(duration, attributes)
+        if attempt:
+            self._retries.add(1, {"endpoint": endpoint})
+
+    def ws_connect(self, duration: float) -> None:
+        self._connect.record(duration)
+
+    def frame(self, staleness: Optional[float]) -> None:
+        self._frames.add(1)
+        if staleness is not None:
+            self._staleness.record(staleness)
+
+    def processing(self, stage: str, duration: float) -> None:
+        self._processing.record(duration, {"stage": stage})
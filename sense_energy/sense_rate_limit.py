@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+from typing import Optional
+
+RATE_LIMIT_BACKOFF = 60
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Token bucket rate limiter for API requests and websocket connects.
+
+    Holds up to `capacity` tokens, refilled at `rate` tokens per second. It is
+    thread safe and can be shared by any number of Sense objects in a process
+    by assigning it to their `rate_limiter`. With a `parent`, both buckets are
+    charged, e.g. a per-account bucket under a global one. A 429 response
+    pauses the bucket for its Retry-After time via `backoff`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, parent: "Optional[TokenBucket]" = None) -> None:
+        """Initialize a full bucket."""
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.parent = parent
+        self.throttled = 0
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self, tokens: float) -> float:
+        """Take tokens, going into debt if needed, and return the seconds to wait."""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            wait = max(self._paused_until - now, -self._tokens / self.rate, 0.0)
+        if self.parent is not None:
+            wait = max(wait, self.parent._reserve(tokens))
+        return wait
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens only if available now, without waiting."""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            if self._paused_until > now or self._tokens < tokens:
+                self.throttled += 1
+                return False
+            if self.parent is not None and not self.parent.try_acquire(tokens):
+                self.throttled += 1
+                return False
+            self._tokens -= tokens
+            return True
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Take tokens, blocking the thread until they are available."""
+        wait = self._reserve(tokens)
+        if wait:
+            self.throttled += 1
+            sleep(wait)
+
+    async def async_acquire(self, tokens: float = 1) -> None:
+        """Take tokens, waiting until they are available."""
+        wait = self._reserve(tokens)
+        if wait:
+            self.throttled += 1
+            await asyncio.sleep(wait)
+
+    def backoff(self, seconds: Optional[float] = None) -> None:
+        """Pause the bucket, and its parent, after the server rate limited us."""
+        if seconds is None:
+            seconds = RATE_LIMIT_BACKOFF
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = max(self._paused_until, now + seconds)
+        if self.parent is not None:
+            self.parent.backoff(seconds)
+
+    @property
+    def available(self) -> float:
+        """Tokens available now; negative while callers are queued."""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            if self._paused_until > now:
+                return min(self._tokens, 0.0)
+            return self._tokens
+
+    @property
+    def budget(self) -> dict:
+        """Current state of the bucket."""
+        return {
+            "available": self.available,
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "paused_for": max(0.0, self._paused_until - monotonic()),
+            "throttled": self.throttled,
+        }
@@ -1,16 +1,22 @@
-import json
+import logging
 import ssl
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import timezone
-from time import time
+from time import perf_counter, sleep, time
+from typing import Optional
 
 import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from requests.exceptions import ReadTimeout
-from websocket import create_connection
-from websocket._exceptions import WebSocketTimeoutException
+from websocket import ABNF, create_connection
+from websocket._exceptions import WebSocketException, WebSocketTimeoutException
 
 from .sense_api import *
 from .sense_exceptions import *
 
+_LOGGER = logging.getLogger(__name__)
+
 
 class Senseable(SenseableBase):
     def __init__(
@@ -22,13 +28,22 @@ class Senseable(SenseableBase):
         ssl_verify=True,
         ssl_cafile="",
         device_id=None,
+        state_file=None,
     ):
         """Init the Senseable object."""
 
         # Create session
         self.s = requests.session()
+        self._pool_size = DEFAULT_POOLSIZE
         self.set_ssl_context(ssl_verify, ssl_cafile)
 
+        # Background realtime connection
+        self._realtime_lock = threading.RLock()
+        self._realtime_thread: Optional[threading.Thread] = None
+        self._realtime_stop = threading.Event()
+        self._auth_lock = threading.Lock()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+
         SenseableBase.__init__(
             self,
             username=username,
@@ -38,8 +53,18 @@ class Senseable(SenseableBase):
             ssl_verify=ssl_verify,
             ssl_cafile=ssl_cafile,
             device_id=device_id,
+            state_file=state_file,
         )
 
+    def _size_connection_pool(self, size):
+        """Grow the session's connection pool so `size` threads can reuse connections."""
+        if size <= self._pool_size:
+            return
+        adapter = HTTPAdapter(pool_maxsize=size)
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
+        self._pool_size = size
+
     def set_ssl_context(self, ssl_verify, ssl_cafile):
         """Create or set the SSL context. Use custom ssl verification, if specified."""
         if not ssl_verify:
@@ -54,7 +79,7 @@ class Senseable(SenseableBase):
 
         # Get auth token
         try:
-            resp = self.s.post(API_URL + "authenticate", auth_data, headers=self.headers, timeout=self.api_timeout)
+            resp = self.s.post(self.api_url + "authenticate", auth_data, headers=self.headers, timeout=self.api_timeout)
         except Exception as e:
             raise Exception(f"Connection failure: {e}")
 
@@ -85,7 +110,7 @@ class Senseable(SenseableBase):
         }
         # Get auth token
         try:
-            resp = self.s.post(API_URL + "authenticate/mfa", mfa_data, headers=self.headers, timeout=self.api_timeout)
+            resp = self.s.post(self.api_url + "authenticate/mfa", mfa_data, headers=self.headers, timeout=self.api_timeout)
         except Exception as e:
             raise Exception(f"Connection failure: {e}")
 
@@ -107,7 +132,7 @@ class Senseable(SenseableBase):
 
         # Get auth token
         try:
-            resp = self.s.post(API_URL + "renew", renew_data, headers=self.headers, timeout=self.api_timeout)
+            resp = self.s.post(self.api_url + "renew", renew_data, headers=self.headers, timeout=self.api_timeout)
         except Exception as e:
             raise Exception(f"Connection failure: {e}")
 
@@ -119,9 +144,25 @@ class Senseable(SenseableBase):
 
         self._set_auth_data(resp.json())
 
+    def _renew_auth_once(self, token):
+        """Renew the token that `token` was, sharing one renewal between threads.
+        Does nothing if the token was already renewed since."""
+        with self._auth_lock:
+            if self.sense_access_token == token:
+                self.renew_auth()
+
+    def _ensure_auth(self):
+        """Renew the token ahead of expiry. Failures are left to the 401 path."""
+        if not self._auth_expiring():
+            return
+        try:
+            self._renew_auth_once(self.sense_access_token)
+        except Exception as e:
+            _LOGGER.debug("Failed to renew auth ahead of expiry: %s", e)
+
     def logout(self):
         try:
-            resp = self.s.get(API_URL + "logout", timeout=self.api_timeout)
+            resp = self.s.get(self.api_url + "logout", timeout=self.api_timeout)
         except Exception as e:
             raise Exception(f"Connection failure: {e}")
 
@@ -130,87 +171,285 @@ class Senseable(SenseableBase):
             raise SenseAPIException(f"API Return Code: {resp.status_code}")
 
     def update_realtime(self, retry=True):
-        """Update the realtime data (device status and current power)."""
+        """Update the realtime data (device status and current power).
+        Returns the latest cached frame without network I/O while a realtime
+        thread started with `start_realtime` is running."""
+        if self.realtime_running:
+            return self._realtime
         # rate limit API calls
         now = time()
         if self._realtime and self.rate_limit and self.last_realtime_call + self.rate_limit > now:
             return self._realtime
         self.last_realtime_call = now
+        self._ensure_auth()
+        token = self.sense_access_token
         try:
             next(self.get_realtime_stream())
         except SenseAuthenticationException as e:
             if retry:
-                self.renew_auth()
+                self._renew_auth_once(token)
                 self.update_realtime(False)
             else:
                 raise e
 
-    def get_realtime_stream(self):
+    def get_realtime_stream(self, raw=False):
         """Reads realtime data from websocket.  Realtime data variable is set and data is
-        returned through generator. Continues until loop broken."""
+        returned through generator. Continues until loop broken.
+        With 'raw' set, lazily decoded RealtimeFrames are yielded instead and the realtime
+        data is not set; pass a frame to `apply_frame` to set it."""
         ws = 0
-        url = WS_URL % (self.sense_monitor_id, self.sense_access_token)
+        url = self.ws_url % (self.sense_monitor_id, self.sense_access_token)
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
         try:
+            connect_start = perf_counter()
             ws = create_connection(url, timeout=self.wss_timeout, sslopt={"cert_reqs": ssl.CERT_NONE})
+            if self.metrics is not None:
+                self.metrics.ws_connect(perf_counter() - connect_start)
             while True:  # hello, features, [updates,] data
-                result = json.loads(ws.recv())
-                if result.get("type") == "realtime_update":
-                    data = result["payload"]
-                    self._set_realtime(data)
+                # decode straight from the frame bytes, skipping the str conversion of recv()
+                opcode, message = ws.recv_data()
+                if opcode == ABNF.OPCODE_CLOSE:
+                    raise SenseWebsocketException("Web Socket closed")
+                data = self._process_realtime_message(message, raw)
+                if data is not None:
                     yield data
-                elif result.get("type") == "error":
-                    data = result["payload"]
-                    if not data["authorized"]:
-                        raise SenseAuthenticationException("Web Socket Unauthorized")
-                    raise SenseWebsocketException(data["error_reason"])
         except WebSocketTimeoutException:
             raise SenseAPITimeoutException("API websocket timed out")
         finally:
             if ws:
                 ws.close()
 
+    def _set_realtime(self, data):
+        """Sets the realtime data structure under the realtime lock."""
+        with self._realtime_lock:
+            return SenseableBase._set_realtime(self, data)
+
+    def _set_trend_data(self, scale, data, dt=None):
+        """Stores trend data under the realtime lock, as it updates the devices."""
+        with self._realtime_lock:
+            SenseableBase._set_trend_data(self, scale, data, dt)
+
+    def load_state(self, path):
+        """Loads a snapshot under the realtime lock, as it updates the devices."""
+        with self._realtime_lock:
+            return SenseableBase.load_state(self, path)
+
+    @property
+    def devices(self) -> list[SenseDevice]:
+        """List of discovered device names."""
+        with self._realtime_lock:
+            return list(self._devices.values())
+
+    @property
+    def active_devices(self):
+        with self._realtime_lock:
+            return [d.name for d in self._devices.values() if d.is_on]
+
+    @property
+    def realtime_running(self) -> bool:
+        """True while the background realtime thread is running."""
+        return self._realtime_thread is not None and self._realtime_thread.is_alive()
+
+    def start_realtime(self):
+        """Start a daemon thread that keeps the realtime websocket open,
+        reconnecting with backoff and renewing auth when needed."""
+        if self.realtime_running:
+            return
+        self._realtime_stop.clear()
+        self._realtime_thread = threading.Thread(target=self._realtime_loop, name="sense-realtime", daemon=True)
+        self._realtime_thread.start()
+
+    def stop_realtime(self, timeout=None):
+        """Stop the background realtime thread. The thread exits after its
+        current read completes, at most `wss_timeout` seconds later."""
+        if not self._realtime_thread:
+            return
+        self._realtime_stop.set()
+        self._realtime_thread.join(timeout)
+        self._realtime_thread = None
+
+    def _realtime_loop(self):
+        """Read the realtime stream until stopped, reconnecting on failure."""
+        failures = 0
+        while not self._realtime_stop.is_set():
+            self._ensure_auth()
+            token = self.sense_access_token
+            try:
+                for _ in self.get_realtime_stream():
+                    failures = 0
+                    self.last_realtime_call = time()
+                    if self._realtime_stop.is_set():
+                        return
+            except SenseAuthenticationException:
+                try:
+                    self._renew_auth_once(token)
+                except Exception as e:
+                    _LOGGER.debug("Failed to renew realtime auth: %s", e)
+            except (SenseAPITimeoutException, SenseWebsocketException, WebSocketException, OSError) as e:
+                _LOGGER.debug("Realtime connection lost: %s", e)
+            except Exception:
+                # e.g. a malformed message; keep the thread alive and reconnect
+                _LOGGER.exception("Unexpected error in the realtime stream")
+            delay = backoff_delay(failures)
+            failures += 1
+            self._realtime_stop.wait(delay)
+
     def _api_call(self, url, payload={}, retry=False):
-        """Make a call to the Sense API directly and return the json results."""
+        """Make a call to the Sense API directly and return the json results.
+        Retries and hedges the request if enabled."""
+        if not retry:
+            self._ensure_auth()
+        token = self.sense_access_token
+        headers = self.headers
+        entry = self.cache.get(url, payload) if self.cache is not None else None
+        if entry is not None:
+            if entry.fresh:
+                return entry.data
+            if entry.etag:
+                headers = {**self.headers, "If-None-Match": entry.etag}
+
+        resp = self._api_get_retried(url, headers, payload)
+        if not retry and resp.status_code == 401:
+            self._renew_auth_once(token)
+            return self._api_call(url, payload, True)
+
+        # 4xx represents unauthenticated
+        if resp.status_code == 401 or resp.status_code == 403 or resp.status_code == 404:
+            raise SenseAuthenticationException(f"API Return Code: {resp.status_code}")
+
+        if resp.status_code == 304 and entry is not None:
+            return self.cache.refresh(url, payload, entry)
+
+        if resp.status_code == 429:
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            if self.rate_limiter:
+                self.rate_limiter.backoff(retry_after)
+            raise SenseRateLimitException(retry_after)
+        data = resp.json()
+        if self.cache is not None and resp.status_code == 200:
+            self.cache.set(url, payload, data, resp.headers.get("ETag"))
+        return data
+
+    def _api_get(self, url, headers, payload, attempt=0):
+        """Make one GET request and return the response."""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        start = perf_counter()
+        status = None
         try:
             resp = self.s.get(
-                API_URL + url,
-                headers=self.headers,
+                self.api_url + url,
+                headers=headers,
                 timeout=self.api_timeout,
                 params=payload,
             )
-
-            if not retry and resp.status_code == 401:
-                self.renew_auth()
-                return self._api_call(url, payload, True)
-
-            # 4xx represents unauthenticated
-            if resp.status_code == 401 or resp.status_code == 403 or resp.status_code == 404:
-                raise SenseAuthenticationException(f"API Return Code: {resp.status_code}")
-            return resp.json()
+            status = resp.status_code
         except ReadTimeout:
             raise SenseAPITimeoutException("API call timed out")
-
-    def get_trend_data(self, scale: Scale, dt=None):
-        """Update trend data for specified scale from API.
-        Optionally set a date to fetch data from."""
+        finally:
+            self._record_api_call(url, status, start, attempt)
+        if status == 200:
+            self._api_latencies.append(perf_counter() - start)
+        return resp
+
+    def _api_get_hedged(self, url, headers, payload, attempt=0):
+        """Make a GET, sending a second one if the first is slower than usual,
+        and return whichever succeeds first. The slower request is left to finish
+        in the background as requests cannot be cancelled."""
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._api_get(url, headers, payload, attempt)
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(thread_name_prefix="sense-hedge")
+        first = self._hedge_executor.submit(self._api_get, url, headers, payload, attempt)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        self.hedge_stats["hedged"] += 1
+        second = self._hedge_executor.submit(self._api_get, url, headers, payload, attempt)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.hedge_stats["hedge_won"] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _api_get_retried(self, url, headers, payload):
+        """Make a GET, retrying timeouts, connection errors and 5xx responses
+        `api_retries` times with backoff."""
+        attempt = 0
+        while True:
+            try:
+                resp = self._api_get_hedged(url, headers, payload, attempt)
+                if resp.status_code < 500 or attempt >= self.api_retries:
+                    return resp
+            except (SenseAPITimeoutException, requests.exceptions.ConnectionError):
+                if attempt >= self.api_retries:
+                    raise
+            sleep(backoff_delay(attempt, API_RETRY_DELAY, API_RETRY_DELAY_MAX))
+            attempt += 1
+
+    def _fetch_trend_data(self, scale: Scale, dt=None):
+        """Fetch trend data for specified scale from API without storing it."""
         if not dt:
             dt = datetime.now(timezone.utc)
-        self._trend_data[scale] = self._api_call(
+        return self._api_call(
             f"app/history/trends?monitor_id={self.sense_monitor_id}&scale={scale.name}&start={dt.strftime('%Y-%m-%dT%H:%M:%S')}"
         )
-        self._update_device_trends(scale)
 
-    def update_trend_data(self, dt=None):
-        """Update trend data of all scales from API.
+    def get_trend_data(self, scale: Scale, dt=None):
+        """Update trend data for specified scale from API.
         Optionally set a date to fetch data from."""
-        for scale in Scale:
-            self.get_trend_data(scale, dt)
+        self._set_trend_data(scale, self._fetch_trend_data(scale, dt), dt)
 
-    def get_monitor_data(self):
-        """Get monitor overview info from API."""
+    def update_trend_data(self, dt=None, max_workers=1, max_age=None):
+        """Update trend data of all scales from API.
+        Optionally set a date to fetch data from. With `max_age`, only scales not
+        fetched within that many seconds are updated. With `max_workers` > 1 the
+        scales are fetched in parallel on a thread pool; scales that were
+        fetched are applied even if others fail, in which case
+        SensePartialUpdateException is raised with the error of each failed scale,
+        chained from the first one. If every scale fails, that first error is raised
+        as is, e.g. SenseAuthenticationException."""
+        scales = list(Scale) if dt else self.stale_scales(max_age)
+        if max_workers <= 1:
+            for scale in scales:
+                self.get_trend_data(scale, dt)
+            return
+
+        self._size_connection_pool(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._fetch_trend_data, scale, dt) for scale in scales]
+        errors = {}
+        # apply on the calling thread in scale order so device merging is unchanged
+        with self._realtime_lock:
+            for scale, future in zip(scales, futures):
+                try:
+                    data = future.result()
+                except Exception as e:
+                    errors[scale] = e
+                    continue
+                self._set_trend_data(scale, data, dt)
+        if errors:
+            first = next(iter(errors.values()))
+            if len(errors) == len(scales):
+                raise first
+            raise SensePartialUpdateException(errors) from first
+
+    def get_monitor_data(self, max_age=None):
+        """Get monitor overview info from API.
+        With `max_age`, the loaded info is returned if fetched within that many seconds."""
+        if max_age is not None and self._monitor and not self.is_stale("monitor", max_age):
+            return self._monitor
         json = self._api_call(f"app/monitors/{self.sense_monitor_id}/overview")
         if "monitor_overview" in json and "monitor" in json["monitor_overview"]:
             self._monitor = json["monitor_overview"]["monitor"]
+            self._mark_updated("monitor")
         return self._monitor
 
     def get_discovered_device_names(self):
@@ -252,3 +491,34 @@ class Senseable(SenseableBase):
         """
         # lots of info in here to be parsed out
         return self._api_call(f"users/{self.sense_user_id}/timeline", payload)
+
+    def iter_timeline(self, n_items=TIMELINE_PAGE_SIZE, device_id=None, prior_to_item=None, since=None, max_items=None):
+        """Yield timeline items one at a time, newest first, paging through the
+        timeline automatically. The next page is fetched in the background while
+        the current one is consumed.
+
+        Args:
+            n_items: the number of items per page
+            device_id: limit results to a specific device_id
+            prior_to_item: start before this date, format YYYY-MM-DDTHH:MM:SS.mmmZ
+            since: stop at items older than this timezone aware datetime
+            max_items: stop after this many items
+        """
+        payload = self._timeline_payload(n_items, device_id, prior_to_item)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(self.get_all_usage_data, payload)
+            count = 0
+            while future:
+                page = future.result()
+                payload = self._timeline_next_payload(page, payload, since)
+                future = executor.submit(self.get_all_usage_data, payload) if payload else None
+                for item in page.get("items") or []:
+                    if since and ciso8601.parse_datetime(item["time"]) < since:
+                        return
+                    yield item
+                    count += 1
+                    if max_items and count >= max_items:
+                        return
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -17,6 +17,7 @@ setup(
         "aiohttp",
         "kasa-crypt>=0.2.0",
     ],
+    extras_require={"numpy": ["numpy"]},
     version=version,
     description="API for the Sense Energy Monitor",
     long_description=long_description,